@@ -5,6 +5,7 @@ processing status of objects from the OI Import Generator.
 """
 
 import sqlite3
+import contextlib
 import json
 import logging
 import datetime
@@ -13,6 +14,29 @@ import os
 # --- Constants ---
 DB_FILE_NAME = "oi_processing_status.db"
 DB_PATH = os.path.abspath(DB_FILE_NAME)
+# Compact separators keep the stored CSV row JSON small; non-ASCII is kept as-is rather than \u-escaped.
+CSV_DATA_JSON_SEPARATORS = (',', ':')
+# Rows per transaction in batch_update_object_statuses; keeps each commit in SQLite's efficient range.
+BATCH_UPDATE_CHUNK_SIZE = 5000
+# Identifiers per IN (...) query in get_objects_by_identifiers; stays under SQLite's 999 bound-parameter limit on older builds.
+BATCH_LOOKUP_CHUNK_SIZE = 900
+
+# --- Connections ---
+
+@contextlib.contextmanager
+def _connect(db_path):
+    """
+    Opens a connection with the module's type detection and per-connection tuning, commits on
+    success / rolls back on error like `with sqlite3.connect(...)`, and always closes it afterwards
+    (so WAL side files are cleaned up as soon as the last connection goes).
+    synchronous=NORMAL skips the fsync on every commit; with the WAL journal set up by init_db
+    a power cut can only lose the last commits, never corrupt the file.
+    """
+    conn = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
+    try:
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with conn: yield conn
+    finally: conn.close()
 
 # --- Database Initialization ---
 
@@ -20,7 +44,9 @@ def init_db(db_path=DB_PATH):
     """Initializes the SQLite database and creates the 'objects' table if it doesn't exist."""
     try:
         logging.info(f"Initializing database at: {db_path}")
-        with sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES) as conn:
+        with _connect(db_path) as conn:
+            # WAL is stored in the database file, so this only needs to happen once per database
+            conn.execute("PRAGMA journal_mode=WAL")
             cursor = conn.cursor()
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS objects (
@@ -56,10 +82,10 @@ def add_pending_objects(object_list, db_path=DB_PATH):
     for obj_data in object_list:
         unique_id = obj_data.get('unique_id'); row_index = obj_data.get('csv_row_index'); csv_data = obj_data.get('csv_data', {})
         if not unique_id: logging.warning(f"Skipping object at row {row_index}: Missing 'unique_id'."); skipped_count += 1; continue
-        rows_to_insert.append((unique_id, row_index, 'pending', None, None, None, None, None, None, timestamp, json.dumps(csv_data)))
+        rows_to_insert.append((unique_id, row_index, 'pending', None, None, None, None, None, None, timestamp, json.dumps(csv_data, separators=CSV_DATA_JSON_SEPARATORS, ensure_ascii=False)))
     if not rows_to_insert: logging.info("No new pending objects to add."); return 0, skipped_count
     try:
-        with sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES) as conn:
+        with _connect(db_path) as conn:
             cursor = conn.cursor()
             cursor.executemany('INSERT OR IGNORE INTO objects (unique_id, csv_row_index, status, node_type, action, identifier, generated_xml, error_message, output_batch_file, last_attempt_timestamp, csv_data_json) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows_to_insert)
             added_count = conn.total_changes; skipped_count += (len(rows_to_insert) - added_count); conn.commit()
@@ -71,7 +97,7 @@ def get_object_status(unique_id, db_path=DB_PATH):
     """Retrieves the current status and data for a specific object by unique_id."""
     if not unique_id: return None
     try:
-        with sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES) as conn:
+        with _connect(db_path) as conn:
             conn.row_factory = sqlite3.Row; cursor = conn.cursor()
             cursor.execute("SELECT * FROM objects WHERE unique_id = ?", (unique_id,))
             row = cursor.fetchone()
@@ -85,6 +111,27 @@ def get_object_status(unique_id, db_path=DB_PATH):
             else: return None
     except Exception as e: logging.error(f"Database error getting status for {unique_id}: {e}", exc_info=True); return None
 
+def get_object_statuses(unique_ids, db_path=DB_PATH, chunk_size=BATCH_LOOKUP_CHUNK_SIZE):
+    """
+    Retrieves just the status of many objects over one connection, using chunked IN queries.
+
+    Returns:
+        dict: unique_id -> status for every ID found. IDs not in the database are left out;
+              on a database error the statuses read so far are returned.
+    """
+    ids = [uid for uid in unique_ids if uid]; statuses = {}
+    if not ids: return statuses
+    chunk_size = max(1, chunk_size)
+    try:
+        with _connect(db_path) as conn:
+            cursor = conn.cursor()
+            for start in range(0, len(ids), chunk_size):
+                chunk = ids[start:start + chunk_size]
+                cursor.execute(f"SELECT unique_id, status FROM objects WHERE unique_id IN ({','.join('?' for _ in chunk)})", chunk)
+                statuses.update(cursor.fetchall())
+    except Exception as e: logging.error(f"Database error getting statuses for {len(ids)} objects: {e}", exc_info=True)
+    return statuses
+
 def update_object_status(unique_id, status, node_type=None, action=None, identifier=None,
                          generated_xml=None, error_message=None, output_batch_file=None,
                          db_path=DB_PATH):
@@ -92,7 +139,7 @@ def update_object_status(unique_id, status, node_type=None, action=None, identif
     if not unique_id: logging.warning("Attempted to update status for object with no unique_id."); return False
     timestamp = datetime.datetime.now()
     try:
-        with sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES) as conn:
+        with _connect(db_path) as conn:
             cursor = conn.cursor()
             cursor.execute('''
                 UPDATE objects
@@ -108,16 +155,20 @@ def update_object_status(unique_id, status, node_type=None, action=None, identif
             else: logging.warning(f"Could not update status for {unique_id}: ID not found."); return False
     except Exception as e: logging.error(f"Database error updating status for {unique_id}: {e}", exc_info=True); return False
 
-def batch_update_object_statuses(updates_list, db_path=DB_PATH):
+def batch_update_object_statuses(updates_list, db_path=DB_PATH, chunk_size=BATCH_UPDATE_CHUNK_SIZE):
     """
     Updates multiple objects in the database in a single batch.
 
+    Updates are written in chunks of `chunk_size` rows, each chunk in its own transaction,
+    so a very large batch never becomes one giant transaction.
+
     Args:
         updates_list (list): A list of dictionaries. Each dictionary must contain 'unique_id'
                              and any of the following optional keys to update: 'status',
                              'node_type', 'action', 'identifier', 'generated_xml',
                              'error_message', 'output_batch_file'.
         db_path (str, optional): Path to the database file. Defaults to DB_PATH.
+        chunk_size (int, optional): Maximum rows per transaction. Defaults to BATCH_UPDATE_CHUNK_SIZE.
 
     Returns:
         tuple: (number_of_successfully_updated_rows, number_of_failed_updates)
@@ -150,52 +201,35 @@ def batch_update_object_statuses(updates_list, db_path=DB_PATH):
         logging.warning("batch_update_object_statuses: No valid items to update after filtering.")
         return 0, len(updates_list) # All items were invalid
 
+    chunk_size = max(1, chunk_size)
     updated_rows_count = 0
-    failed_updates_count = 0
+    committed_count = 0
 
     try:
-        with sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES) as conn:
+        with _connect(db_path) as conn:
             cursor = conn.cursor()
-            # Using COALESCE for fields that might not be in every item,
-            # so they retain their existing value if not provided in the update.
-            # However, for error_message, we want to explicitly set it (even to NULL),
-            # so it's not coalesced.
-            # For generated_xml, if it's explicitly set to None, it should be NULL.
-            # output_batch_file should also be explicitly updatable.
-            cursor.executemany('''
-                UPDATE objects
-                SET
-                    status = COALESCE(?, status),
-                    node_type = COALESCE(?, node_type),
-                    action = COALESCE(?, action),
-                    identifier = COALESCE(?, identifier),
-                    generated_xml = COALESCE(?, generated_xml),
-                    error_message = ?,
-                    output_batch_file = COALESCE(?, output_batch_file),
-                    last_attempt_timestamp = ?
-                WHERE unique_id = ?
-            ''', params_to_execute)
-            updated_rows_count = cursor.rowcount # Note: executemany on UPDATE might not give accurate rowcount on all sqlite versions/drivers.
-                                               # For precise count, one might need to re-query or iterate updates.
-                                               # However, for performance, this is a common approach.
-                                               # If an ID doesn't exist, it's not an error, just 0 rows updated for that item.
-            conn.commit()
-            
-            # A more accurate way to count, but slower:
-            # for param_set in params_to_execute:
-            #     cursor.execute(THE_SAME_UPDATE_QUERY_AS_ABOVE_BUT_FOR_ONE_ROW, param_set)
-            #     if cursor.rowcount > 0: updated_rows_count +=1 
-            #     else: failed_updates_count +=1 # Assuming unique_id should exist
-            # conn.commit()
-
-        # Assuming if an ID doesn't exist, it's not strictly a "failed update" for the batch operation itself,
-        # but rather that particular item didn't match.
-        # The definition of "failed_updates_count" here would be items that errored out during DB operation,
-        # which executemany usually handles by rolling back the whole transaction or raising an exception.
-        # If the operation completes, we assume all listed operations were "attempted".
-        # We'll consider an update "successful" if it was part of the committed transaction.
-        # A more robust check for individual row success would be more complex.
-        
+            for start in range(0, len(params_to_execute), chunk_size):
+                chunk = params_to_execute[start:start + chunk_size]
+                # COALESCE keeps existing values for fields not provided in the update.
+                # error_message is deliberately not coalesced so a success clears any old error.
+                with conn: # One transaction per chunk; rolled back on error.
+                    cursor.executemany('''
+                        UPDATE objects
+                        SET
+                            status = COALESCE(?, status),
+                            node_type = COALESCE(?, node_type),
+                            action = COALESCE(?, action),
+                            identifier = COALESCE(?, identifier),
+                            generated_xml = COALESCE(?, generated_xml),
+                            error_message = ?,
+                            output_batch_file = COALESCE(?, output_batch_file),
+                            last_attempt_timestamp = ?
+                        WHERE unique_id = ?
+                    ''', chunk)
+                # executemany rowcount is the total rows modified; IDs not found simply don't count.
+                updated_rows_count += cursor.rowcount
+                committed_count += len(chunk)
+
         logging.info(f"Batch update: Attempted to update {len(params_to_execute)} objects. Rows affected (approx): {updated_rows_count}.")
         # If rowcount is less than len(params_to_execute), it means some unique_ids were not found.
         # This is not an error for the batch itself, but those specific items were not updated.
@@ -203,10 +237,11 @@ def batch_update_object_statuses(updates_list, db_path=DB_PATH):
 
     except sqlite3.Error as e:
         logging.error(f"Database error during batch update: {e}", exc_info=True)
-        return 0, len(params_to_execute) # All items in this batch failed due to the error
+        # Chunks committed before the error stay written; only the remainder failed.
+        return updated_rows_count, len(params_to_execute) - committed_count
     except Exception as e:
         logging.error(f"Unexpected error during batch update: {e}", exc_info=True)
-        return 0, len(params_to_execute)
+        return updated_rows_count, len(params_to_execute) - committed_count
 
 
 # --- Query Functions for Reporting / Reprocessing ---
@@ -216,7 +251,7 @@ def get_objects_by_status(status_list, db_path=DB_PATH):
     if not status_list: return []
     results = []
     try:
-        with sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES) as conn:
+        with _connect(db_path) as conn:
             conn.row_factory = sqlite3.Row; cursor = conn.cursor()
             placeholders = ','.join('?' for status in status_list)
             query = f"SELECT * FROM objects WHERE status IN ({placeholders}) ORDER BY csv_row_index"
@@ -250,7 +285,7 @@ def get_object_by_identifier(identifier, db_path=DB_PATH):
     if not identifier:
         return None
     try:
-        with sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES) as conn:
+        with _connect(db_path) as conn:
             conn.row_factory = sqlite3.Row # Return rows as dictionary-like objects
             cursor = conn.cursor()
             # Query based on the identifier column
@@ -283,11 +318,51 @@ def get_object_by_identifier(identifier, db_path=DB_PATH):
         logging.error(f"Unexpected error getting object by identifier '{identifier}': {e}", exc_info=True)
         return None
 
+def get_objects_by_identifiers(identifiers, db_path=DB_PATH, chunk_size=BATCH_LOOKUP_CHUNK_SIZE):
+    """
+    Looks up many identifiers at once, with the same matching rules as get_object_by_identifier.
+    All lookups share one connection and run as chunked IN queries instead of one query per identifier.
+
+    Args:
+        identifiers (iterable): Identifiers (title or location) to search for. Duplicates are looked up once.
+        db_path (str, optional): Path to the database file. Defaults to DB_PATH.
+        chunk_size (int, optional): Maximum identifiers per query. Defaults to BATCH_LOOKUP_CHUNK_SIZE.
+
+    Returns:
+        dict: identifier -> object dict (with parsed 'csv_data') for every identifier found.
+              Identifiers with no match are left out; on a database error the matches found so far are returned.
+    """
+    wanted = list(dict.fromkeys(i for i in identifiers if i))
+    results = {}; match_counts = {}
+    if not wanted: return results
+    chunk_size = max(1, chunk_size)
+    try:
+        with _connect(db_path) as conn:
+            conn.row_factory = sqlite3.Row; cursor = conn.cursor()
+            for start in range(0, len(wanted), chunk_size):
+                chunk = wanted[start:start + chunk_size]
+                placeholders = ','.join('?' for _ in chunk)
+                # rowid order matches the order get_object_by_identifier sees duplicates in
+                cursor.execute(f"SELECT * FROM objects WHERE identifier IN ({placeholders}) ORDER BY identifier, rowid", chunk)
+                for row in cursor.fetchall():
+                    identifier = row['identifier']; match_counts[identifier] = match_counts.get(identifier, 0) + 1
+                    if identifier in results: continue
+                    row_dict = dict(row)
+                    if row_dict.get('csv_data_json'):
+                        try: row_dict['csv_data'] = json.loads(row_dict['csv_data_json'])
+                        except json.JSONDecodeError: logging.warning(f"Could not parse csv_data_json for unique_id {row_dict.get('unique_id')} found via identifier '{identifier}'"); row_dict['csv_data'] = {}
+                    else: row_dict['csv_data'] = {}
+                    results[identifier] = row_dict
+    except Exception as e: logging.error(f"Database error looking up {len(wanted)} identifiers: {e}", exc_info=True)
+    for identifier, count in match_counts.items():
+        if count > 1: logging.warning(f"Found multiple ({count}) database entries matching identifier '{identifier}'. Using the first one found (ID: {results[identifier]['unique_id']}).")
+    return results
+
 def get_status_counts(db_path=DB_PATH):
     """Gets the count of objects for each status."""
     counts = {}
     try:
-        with sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES) as conn:
+        with _connect(db_path) as conn:
             cursor = conn.cursor(); cursor.execute("SELECT status, COUNT(*) FROM objects GROUP BY status")
             rows = cursor.fetchall();
             for row in rows: counts[row[0]] = row[1]
@@ -298,7 +373,7 @@ def get_file_type_counts(db_path=DB_PATH):
     """Gets the count of successfully processed objects grouped by node_type."""
     counts = {}
     try:
-        with sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES) as conn:
+        with _connect(db_path) as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT COALESCE(node_type, 'Unknown'), COUNT(*) FROM objects WHERE status = 'success' GROUP BY COALESCE(node_type, 'Unknown')")
             rows = cursor.fetchall();
@@ -310,7 +385,7 @@ def get_file_type_counts(db_path=DB_PATH):
 def clear_database(db_path=DB_PATH):
     """Deletes all records from the objects table. Use with caution!"""
     try:
-        with sqlite3.connect(db_path) as conn: cursor = conn.cursor(); cursor.execute("DELETE FROM objects"); conn.commit()
+        with _connect(db_path) as conn: cursor = conn.cursor(); cursor.execute("DELETE FROM objects"); conn.commit()
         logging.warning(f"Cleared all records from the database: {db_path}"); return True
     except Exception as e: logging.error(f"Database error clearing table: {e}", exc_info=True); return False
 
@@ -20,6 +20,7 @@ Requires db_handler.py in the same directory.
 """
 
 import threading
+import collections
 import csv
 import os
 import json
@@ -31,7 +32,10 @@ from tkinter.ttk import Style
 from datetime import datetime
 import logging
 import queue
+import time
+import tempfile
 import uuid
+import functools
 
 # --- Import Database Handler ---
 try:
@@ -42,14 +46,14 @@ except ImportError:
 
 # --- Import XML to CSV Converter ---
 try:
-    from xml_to_csv_converter import convert_xml_to_csv
+    from xml_to_csv_converter import convert_xml_to_csv, write_records_csv, element_to_record, iter_top_level_elements
 except ImportError:
     logging.error("xml_to_csv_converter.py not found. XML to CSV functionality will be disabled.")
-    convert_xml_to_csv = None
+    convert_xml_to_csv = write_records_csv = element_to_record = iter_top_level_elements = None
 
 # -------------------- Logging Setup --------------------
 # ... (logging setup code remains as it was in the original file) ...
-log_queue = queue.Queue()
+log_queue = queue.SimpleQueue()
 class TkinterLogHandler(logging.Handler):
     def __init__(self, text_widget):
         super().__init__()
@@ -58,18 +62,24 @@ class TkinterLogHandler(logging.Handler):
         msg = self.format(record)
         log_queue.put(msg + "\n")
 
+LOG_WIDGET_MAX_LINES = 5000  # Older lines are trimmed from the Log Output tab (the log file keeps everything).
+
 def process_log_queue(text_widget):
-    while not log_queue.empty():
-        try:
-            message = log_queue.get_nowait()
-            if text_widget.winfo_exists():
-                 text_widget.insert(tk.END, message)
-                 text_widget.see(tk.END)
-            else: break
+    if not text_widget.winfo_exists(): return
+    # Drain everything queued since the last poll and insert it in one call, so a log storm costs one redraw per poll.
+    messages = []
+    while True:
+        try: messages.append(log_queue.get_nowait())
         except queue.Empty: break
-        except Exception as e: print(f"Error updating Tkinter log widget: {e}"); break
-    if text_widget.winfo_exists():
-        text_widget.after(100, lambda: process_log_queue(text_widget))
+    if messages:
+        try:
+            text_widget.insert(tk.END, "".join(messages))
+            line_count = int(text_widget.index("end-1c").split(".")[0])
+            if line_count > LOG_WIDGET_MAX_LINES: text_widget.delete("1.0", f"{line_count - LOG_WIDGET_MAX_LINES + 1}.0")
+            text_widget.see(tk.END)
+        except Exception as e: print(f"Error updating Tkinter log widget: {e}")
+    # Records arrive from worker threads, which must not touch Tk, so the UI thread still polls.
+    text_widget.after(100, lambda: process_log_queue(text_widget))
 
 def setup_logging(log_widget):
     log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
@@ -92,14 +102,27 @@ def load_config_from_path(path):
     except Exception as e: logging.exception(f"Error loading config from {path}"); return {}
 
 def save_config_to_path(config, path):
+    """
+    Writes the config JSON to a uniquely named temporary file beside path, syncs it to disk and swaps it in,
+    so an interrupted save never leaves a truncated file and concurrent saves never share a temp file.
+    """
+    temp_path = None
     try:
-        with open(path, "w", encoding="utf-8") as f: json.dump(config, f, indent=4)
-        logging.info(f"Configuration saved to: {path}")
-    except Exception as e: logging.exception(f"Error saving config to {path}")
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=os.path.dirname(os.path.abspath(path)), prefix=os.path.basename(path) + ".", suffix=".tmp", delete=False) as f:
+            temp_path = f.name
+            json.dump(config, f, indent=4); f.flush(); os.fsync(f.fileno())
+        os.replace(temp_path, path); logging.info(f"Configuration saved to: {path}")
+    except Exception as e:
+        logging.exception(f"Error saving config to {path}")
+        if temp_path:
+            try: os.remove(temp_path)
+            except OSError: pass
 
 RECOGNISED_STANDARD = {"nodetype", "title", "description", "location", "created", "modified", "createdby", "createby", "action", "file", "category", "version", "docnum", "modifiedby"}
 MIME_MAP = {"dwg": "application/x-acad", "arj": "application/x-arj-compressed", "tgz": "application/x-compressed", "cpio": "application/x-cpio", "csh": "application/x-csh", "dvi": "application/x-dvi", "emf": "application/x-emf", "exe": "application/x-exe", "gtar": "application/x-gtar", "gz": "application/x-gzip", "zip": "application/x-zip-compressed", "hdf": "application/x-hdf", "js": "application/x-javascript", "latex": "application/x-latex", "mif": "application/x-mif", "nc": "application/x-netcdf", "cdf": "application/x-netcdf", "msg": "application/x-outlook-msg", "pdf": "application/x-pdf", "xls": "application/x-msexcel", "ppt": "application/x-mspowerpoint", "rar": "application/x-rar-compressed", "sh": "application/x-sh", "tar": "application/x-tar", "tcl": "application/x-tcl", "tex": "application/x-tex", "texinfo": "application/x-texinfo", "tif": "image/x-tiff", "tiff": "image/x-tiff", "png": "application/x-png", "bmp": "application/x-bmp", "jpg": "image/jpeg", "jpeg": "image/jpeg", "gif": "image/gif", "avi": "video/x-msvideo", "mov": "video/x-sgi-movie", "flv": "video/x-flv", "mp3": "audio/x-mpeg", "wav": "audio/x-wav", "doc": "application/msword", "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document", "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "pptx": "application/vnd.openxmlformats-officedocument.presentationml.presentation"}
+MIME_BY_EXTENSION = {f".{ext}": mime for ext, mime in MIME_MAP.items()} # Keyed like os.path.splitext()[1].lower()
 global_docnum_counter = 100000
+CSV_SNIFFER = csv.Sniffer()  # Stateless; shared by every delimiter auto-detection.
 DEFAULT_SPECIAL_CHAR_MAP = {"&": "and", "’": "'", "“": '"', "”": '"'}
 DEFAULT_CLEANSING_OPTIONS = {
     "normalize_paths": True,
@@ -111,9 +134,26 @@ DEFAULT_CLEANSING_OPTIONS = {
     "apply_special_map": True,
 }
 
+@functools.lru_cache(maxsize=None)
+def custom_csv_dialect(csv_delimiter, csv_quotechar):
+    """csv.Dialect for a user-supplied delimiter and quote character, built once per pair."""
+    return type('CustomDialect', (csv.Dialect,), {'delimiter': csv_delimiter, 'quotechar': csv_quotechar or '"', 'doublequote': True, 'skipinitialspace': True, 'lineterminator': "\r\n", 'quoting': csv.QUOTE_MINIMAL})()
+
+def detect_csv_dialect(f, csv_delimiter="", csv_quotechar=""):
+    """
+    Dialect for an open CSV file: the user's delimiter when one is set (nothing is read),
+    otherwise a sniff of the first 2 KB, after which f is rewound to the start.
+    """
+    if csv_delimiter: return custom_csv_dialect(csv_delimiter, csv_quotechar)
+    sample = f.read(2048); f.seek(0)
+    try: return CSV_SNIFFER.sniff(sample, delimiters=[',', ';', '\t', '|'])
+    except csv.Error: return csv.excel
+
 # -------------------- Core Processing Logic (process_row etc.) --------------------
 # ... (simplify_category, apply_special_char_replacements, wrap_cdata, generate_default_mapping, normalize_mapping, add_standard_elements remain as original)
+@functools.lru_cache(maxsize=4096)
 def simplify_category(full_category):
+    """Last ':'-separated segment of a category path; cached as the category selector re-simplifies every category each time it opens."""
     parts = full_category.split(":")
     return parts[-1].strip() if len(parts) > 1 else full_category.strip()
 
@@ -130,12 +170,33 @@ def apply_special_char_replacements(text, special_map, log_callback=None, field_
     return cleaned_text
 
 
+@functools.lru_cache(maxsize=None)
+def _colon_table(replacement):
+    """Translate table replacing ':' with `replacement`; cached since options rarely change within a run."""
+    return str.maketrans({":": replacement})
+
 def maybe_apply_special_chars(text, special_map, cleansing_options, log_callback=None,
                               field_name=None, stage="output", row_index=None):
     if not cleansing_options.get("apply_special_map", True):
         return text
     return apply_special_char_replacements(text, special_map, log_callback, field_name, stage, row_index)
 
+_MULTI_SLASH_RE = re.compile(r'(?<=.)/{2,}')
+_DOT_SEGMENT_RE = re.compile(r'(?:^|/)\.\.?(?:/|$)')
+
+def split_xml_path(path):
+    """
+    Splits a '/'-separated path into (directory prefix including its trailing '/', base name),
+    collapsing repeated slashes and dropping trailing ones. A leading '//' (UNC share) is kept.
+    Paths with '.' or '..' segments still go through os.path.normpath so they resolve as before.
+    """
+    if path.startswith('///') or not path.strip('/') or _DOT_SEGMENT_RE.search(path):
+        normalized = os.path.normpath(path).replace(os.sep, '/')
+    else:
+        normalized = _MULTI_SLASH_RE.sub('/', path).rstrip('/')
+    slash = normalized.rfind('/')
+    return normalized[:slash + 1], normalized[slash + 1:]
+
 def wrap_cdata(text):
     if "<![CDATA[" in text: return text
     return f"<![CDATA[{text}]]>"
@@ -157,6 +218,35 @@ def normalize_mapping(mapping):
         norm[norm_key] = norm_value
     return norm
 
+MAP_IGNORE, MAP_STANDARD, MAP_METADATA = 0, 1, 2
+_MAPPING_TYPE_CODES = {"ignore": MAP_IGNORE, "standard": MAP_STANDARD, "metadata": MAP_METADATA}
+
+def compile_mapping_plan(mapping):
+    """
+    Flattens a column mapping into (csv column, type code, target label, std key, categories) tuples
+    so process_row does no string classification per row. Ignored and unknown types are dropped.
+    """
+    plan = []
+    for col_csv, mapinfo in mapping.items():
+        map_type = _MAPPING_TYPE_CODES.get(mapinfo.get("MappingType", "").lower(), MAP_IGNORE)
+        if map_type == MAP_IGNORE: continue
+        target_label = mapinfo.get("TargetLabel", "").strip()
+        std_key = target_label.lower() if target_label.lower() in ("action", "nodetype") else target_label
+        categories = tuple(c.strip() for c in mapinfo.get("Category", "").split(",") if c.strip())
+        plan.append((col_csv, map_type, target_label, std_key, categories))
+    return plan
+
+@functools.lru_cache(maxsize=64)
+def csv_column_keys(column_names):
+    """
+    Maps each normalised (stripped, lower-cased) CSV column name to the first original column name it came from.
+    Keyed by the tuple of a row's column names, so every row of a CSV shares one lookup table.
+    """
+    keys = {}
+    for name in column_names:
+        if isinstance(name, str): keys.setdefault(name.strip().lower(), name) # DictReader files surplus fields under None
+    return keys
+
 def add_standard_elements(node, std, special_map, cleansing_options, cleansing_callback=None, row_index=None):
     primary_order = ["location", "title", "description", "created", "createby", "version", "file", "mimetype", "docnum", "createdby"]
     added_keys = set()
@@ -173,8 +263,11 @@ def add_standard_elements(node, std, special_map, cleansing_options, cleansing_c
 
 def process_row(row_index, csv_data, mapping, default_location, username, selected_action,
                 default_node_type, category_default, use_csv_createdby, report_dict,
-                rename_list, special_map, cleansing_options=None, cleansing_callback=None):
+                rename_list, special_map, cleansing_options=None, cleansing_callback=None,
+                mapping_plan=None):
     global global_docnum_counter
+    if mapping_plan is None:
+        mapping_plan = compile_mapping_plan(mapping)
     if cleansing_options is None:
         cleansing_options = dict(DEFAULT_CLEANSING_OPTIONS)
     else:
@@ -187,22 +280,16 @@ def process_row(row_index, csv_data, mapping, default_location, username, select
         if cleansing_callback and original != cleaned:
             cleansing_callback(stage, field, original, cleaned, row_index, note)
     try:
-        for col_csv, mapinfo in mapping.items():
-            original_col_key = next((k for k in csv_data if k.strip().lower() == col_csv), None)
+        column_keys = csv_column_keys(tuple(csv_data))
+        for col_csv, map_type, target_label, std_key, categories in mapping_plan:
+            original_col_key = column_keys.get(col_csv)
             if original_col_key is None: continue
             value = csv_data.get(original_col_key, "").strip()
-            map_type = mapinfo.get("MappingType", "").lower()
-            target_label = mapinfo.get("TargetLabel", "").strip()
-            category_str = mapinfo.get("Category", "").strip()
-            if map_type == "ignore": continue
-            elif map_type == "standard":
-                std_key = target_label.lower() if target_label.lower() in ("action", "nodetype") else target_label
+            if map_type == MAP_STANDARD:
                 std[std_key] = value
-                if category_str:
-                     for cat in [c.strip() for c in category_str.split(",") if c.strip()]: meta_by_cat.setdefault(cat, {})[target_label] = value
-            elif map_type == "metadata":
-                cats = [c.strip() for c in category_str.split(",") if c.strip()] or [category_default]
-                for cat in cats:
+                for cat in categories: meta_by_cat.setdefault(cat, {})[target_label] = value
+            else:
+                for cat in categories or (category_default,):
                     if cat: meta_by_cat.setdefault(cat, {})[target_label] = value
 
         if default_location and "location" not in std: std["location"] = default_location
@@ -214,19 +301,12 @@ def process_row(row_index, csv_data, mapping, default_location, username, select
         if original_file and cleansing_options.get("normalize_paths", True):
             try:
                 standardized_path = original_file.replace('\\', '/')
-                normalized_path = os.path.normpath(standardized_path)
-                dir_name, base_name = os.path.split(normalized_path)
-                colon_replacement = cleansing_options.get("path_colon_replacement", "")
-                new_base = base_name.replace(":", colon_replacement)
-
-                if not dir_name or dir_name == '.':
-                    xml_path_representation = new_base
-                else:
-                    dir_name_fwd = dir_name.replace(os.sep, '/')
-                    xml_path_representation = f"{dir_name_fwd}/{new_base}"
+                dir_prefix, base_name = split_xml_path(standardized_path)
+                new_base = base_name.translate(_colon_table(cleansing_options.get("path_colon_replacement", "")))
+                xml_path_representation = dir_prefix + new_base
 
                 if xml_path_representation != standardized_path:
-                    rename_list.append((original_file, xml_path_representation))
+                    rename_list[original_file] = xml_path_representation
                     log_cleaning("input", "file path", original_file, xml_path_representation,
                                  "Normalized file path for XML compatibility")
 
@@ -234,7 +314,7 @@ def process_row(row_index, csv_data, mapping, default_location, username, select
                 elif "filepath" in std: std["filepath"] = xml_path_representation
 
                 ext_field = os.path.splitext(new_base)[1].lower()
-                mime_type = MIME_MAP.get(ext_field.lstrip("."), "")
+                mime_type = MIME_BY_EXTENSION.get(ext_field, "")
                 if mime_type: std["mimetype"] = mime_type
                 elif std.get("nodetype", "").lower() == "document": std["mimetype"] = "application/octet-stream"
             except Exception as e: logging.warning(f"Row {row_index}: Error processing file path '{original_file}': {e}")
@@ -244,7 +324,7 @@ def process_row(row_index, csv_data, mapping, default_location, username, select
                 if "file" in std: std["file"] = xml_path_representation
                 elif "filepath" in std: std["filepath"] = xml_path_representation
                 ext_field = os.path.splitext(os.path.basename(xml_path_representation))[1].lower()
-                mime_type = MIME_MAP.get(ext_field.lstrip("."), "")
+                mime_type = MIME_BY_EXTENSION.get(ext_field, "")
                 if mime_type: std["mimetype"] = mime_type
             except Exception as e:
                 logging.warning(f"Row {row_index}: Error preserving file path '{original_file}': {e}")
@@ -264,8 +344,7 @@ def process_row(row_index, csv_data, mapping, default_location, username, select
 
         if node_type_lower == "document" and "docnum" not in std and action_lower not in ("delete", "update"): global_docnum_counter += 1; std["docnum"] = str(global_docnum_counter)
         if "title" in std and cleansing_options.get("clean_title_colons", True):
-            replacement_val = cleansing_options.get("title_colon_replacement", "")
-            cleaned_title = std["title"].replace(":", replacement_val)
+            cleaned_title = std["title"].translate(_colon_table(cleansing_options.get("title_colon_replacement", "")))
             log_cleaning("input", "title", std["title"], cleaned_title, "Removed colons from title")
             std["title"] = cleaned_title
 
@@ -273,8 +352,7 @@ def process_row(row_index, csv_data, mapping, default_location, username, select
             try:
                 parts = std["location"].split(':')
                 if len(parts) > 1:
-                    replacement_val = cleansing_options.get("location_colon_replacement", "")
-                    loc_tail_cleaned = parts[-1].replace(":", replacement_val)
+                    loc_tail_cleaned = parts[-1].translate(_colon_table(cleansing_options.get("location_colon_replacement", "")))
                     prefix_loc = ":".join(parts[:-1])
                     cleaned_location = f"{prefix_loc}:{loc_tail_cleaned}"
                     log_cleaning("input", "location", std["location"], cleaned_location,
@@ -314,41 +392,65 @@ def process_row(row_index, csv_data, mapping, default_location, username, select
 
 # -------------------- XML/File Generation --------------------
 # ... (serialize_element, write_xml_batch, generate_rename_script remain as original) ...
+def escape_xml_text(text):
+    """Escapes & < > for element text."""
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+def escape_xml_attr(value):
+    """Escapes & < " for a double-quoted attribute value."""
+    return value.replace('&', '&amp;').replace('<', '&lt;').replace('"', '&quot;')
+
 def serialize_element(elem, cdata_set):
-    tag = elem.tag; s = f"<{tag}"
-    for attr, val in elem.attrib.items(): esc_val = val.replace('"', '&quot;'); s += f' {attr}="{esc_val}"'
-    s += ">"
-    if elem.text and elem.text.strip():
-        txt = elem.text
-        if ("*" in cdata_set) or (tag.lower() in cdata_set): s += wrap_cdata(txt)
-        else: esc_txt = txt.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;'); s += esc_txt
-    for child in elem: s += serialize_element(child, cdata_set)
-    s += f"</{tag}>"
-    if elem.tail and elem.tail.strip():
-        tail = elem.tail; esc_tail = tail.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;'); s += esc_tail
-    return s
+    """Serializes elem (and its tail) to a string, wrapping text of tags in cdata_set ('*' = all) in CDATA."""
+    wrap_all = "*" in cdata_set
+    parts = []; append = parts.append
+    # Explicit stack of (element, child iterator); the None sentinel yields the root as its only child.
+    stack = [(None, iter((elem,)))]
+    while stack:
+        parent, children = stack[-1]
+        node = next(children, None)
+        if node is None:
+            stack.pop()
+            if parent is not None:
+                append(f"</{parent.tag}>")
+                if parent.tail and parent.tail.strip(): append(escape_xml_text(parent.tail))
+            continue
+        tag = node.tag; append(f"<{tag}")
+        for attr, val in node.attrib.items(): append(f' {attr}="{escape_xml_attr(val)}"')
+        append(">")
+        txt = node.text
+        if txt and txt.strip():
+            if wrap_all or (tag.lower() in cdata_set): append(wrap_cdata(txt))
+            else: append(escape_xml_text(txt))
+        stack.append((node, iter(node)))
+    return "".join(parts)
 
 def write_xml_batch(nodes_with_ids, output_path, cdata_fields):
-    if not nodes_with_ids: logging.warning(f"Attempted to write empty batch to {output_path}. Skipping."); return []
-    root = ET.Element("import"); valid_nodes_count = 0; processed_ids_in_batch = []
-    for node_elem, unique_id in nodes_with_ids:
-        if node_elem is not None: root.append(node_elem); valid_nodes_count += 1; processed_ids_in_batch.append(unique_id)
-    if valid_nodes_count == 0: logging.warning(f"Batch for {output_path} contained no valid nodes. Skipping file write."); return []
+    """
+    Writes one <import> batch file and returns {unique_id: node_xml} for the nodes written.
+    Each node is serialized exactly once; the same string goes to the file and back to the caller for the DB.
+    """
+    if not nodes_with_ids: logging.warning(f"Attempted to write empty batch to {output_path}. Skipping."); return {}
     cdata_set = set();
     if cdata_fields:
         if cdata_fields.strip() == "*": cdata_set = {"*"}
         else: cdata_set = set(field.strip().lower() for field in cdata_fields.split(",") if field.strip())
-    xml_string = serialize_element(root, cdata_set); xml_string = '<?xml version="1.0" encoding="utf-8"?>\n' + xml_string
+    xml_by_id = {}
+    for node_elem, unique_id in nodes_with_ids:
+        if node_elem is not None: xml_by_id[unique_id] = serialize_element(node_elem, cdata_set)
+    if not xml_by_id: logging.warning(f"Batch for {output_path} contained no valid nodes. Skipping file write."); return {}
     try:
-        with open(output_path, "w", encoding="utf-8") as f: f.write(xml_string)
-        logging.info(f"XML batch saved to: {output_path} ({valid_nodes_count} nodes)")
-        return processed_ids_in_batch
-    except Exception as e: logging.exception(f"Failed to write XML batch to {output_path}"); return []
+        # The node strings are kept for the DB anyway; write them one by one rather than joining a second full copy
+        with open(output_path, "w", encoding="utf-8", buffering=1 << 20) as f: f.write('<?xml version="1.0" encoding="utf-8"?>\n<import>'); f.writelines(xml_by_id.values()); f.write("</import>")
+        logging.info(f"XML batch saved to: {output_path} ({len(xml_by_id)} nodes)")
+        return xml_by_id
+    except Exception as e: logging.exception(f"Failed to write XML batch to {output_path}"); return {}
 
 def generate_rename_script(rename_list, output_dir):
+    """Writes rename_files.ps1 from rename_list, a {original path: new path} dict (one line per original file)."""
     if not rename_list: logging.info("No files require renaming."); return None
     lines = []
-    for original, new in rename_list:
+    for original, new in rename_list.items():
         try:
             new_basename = os.path.basename(new); ps_original = original.replace('"', '`"'); ps_new_basename = new_basename.replace('"', '`"')
             line = f'Rename-Item -Path "{ps_original}" -NewName "{ps_new_basename}" -ErrorAction SilentlyContinue'; lines.append(line)
@@ -359,6 +461,22 @@ def generate_rename_script(rename_list, output_dir):
         logging.info(f"Rename script generated: {script_path}"); return script_path
     except Exception as e: logging.exception(f"Failed to write rename script {script_path}"); return None
 
+def write_batch_and_update_db(batch_number, nodes_with_ids, db_updates, output_path, cdata_fields):
+    """
+    Writes one XML batch, fills generated_xml and output_batch_file of its 'success' updates from the
+    serialized nodes, then persists every update of the batch. With no nodes only the DB update runs.
+    """
+    if nodes_with_ids:
+        xml_by_id = write_xml_batch(nodes_with_ids, output_path, cdata_fields)
+        for update_item in db_updates:
+            if update_item['unique_id'] in xml_by_id and update_item['status'] == 'success':
+                update_item['output_batch_file'] = output_path
+                update_item['generated_xml'] = xml_by_id[update_item['unique_id']]
+    # Persist statuses per XML batch so a crash only loses the batch in flight and memory stays bounded.
+    updated_db_rows, failed_db_updates = db_handler.batch_update_object_statuses(db_updates)
+    label = f"Batch {batch_number}" if batch_number is not None else "Final"
+    logging.info(f"{label} DB update complete. Successfully updated rows (approx): {updated_db_rows}, Failed/Not Found: {failed_db_updates}")
+
 # -------------------- Main Processing Function (DB Integrated -) --------------------
 # ... (run_processing remains as original) ...
 def run_processing(csv_file, xml_base, default_location, category, username,
@@ -372,23 +490,18 @@ def run_processing(csv_file, xml_base, default_location, category, username,
     db_updates_batch = [] 
     try:
         with open(csv_file, "r", encoding="utf-8-sig") as f:
-            sample = f.read(2048); f.seek(0); dialect = None
-            if csv_delimiter:
-                 class CustomDialect(csv.Dialect): delimiter = csv_delimiter; quotechar = csv_quotechar or '"'; doublequote = True; skipinitialspace = True; lineterminator = "\r\n"; quoting = csv.QUOTE_MINIMAL
-                 dialect = CustomDialect()
-            else:
-                try: dialect = csv.Sniffer().sniff(sample, delimiters=[',', ';', '\t', '|'])
-                except csv.Error: dialect = csv.excel
-            reader = csv.DictReader(f, dialect=dialect); original_fieldnames = reader.fieldnames or []
+            reader = csv.DictReader(f, dialect=detect_csv_dialect(f, csv_delimiter, csv_quotechar)); original_fieldnames = reader.fieldnames or []
             if not original_fieldnames: raise ValueError("CSV file has no header row.")
             for i, row_data in enumerate(reader):
-                unique_id = uuid.uuid4().hex; objects_for_db.append({'unique_id': unique_id, 'csv_row_index': i + 1, 'csv_data': dict(row_data)})
+                unique_id = uuid.uuid4().hex; objects_for_db.append({'unique_id': unique_id, 'csv_row_index': i + 1, 'csv_data': row_data}) # DictReader already yields a fresh dict per row
         logging.info(f"Read {len(objects_for_db)} rows from CSV.")
     except Exception as e: logging.exception(f"Failed to read CSV file {csv_file}"); return mapping
     added_count, skipped_count = db_handler.add_pending_objects(objects_for_db)
     logging.info(f"Database sync: Added {added_count} new objects, {skipped_count} were existing.")
+    db_statuses = db_handler.get_object_statuses([o['unique_id'] for o in objects_for_db]) # One bulk read instead of a SELECT per row
     if not mapping: mapping = generate_default_mapping(original_fieldnames)
     else: mapping = normalize_mapping(mapping)
+    mapping_plan = compile_mapping_plan(mapping)
     try:
         output_dir = os.path.dirname(os.path.abspath(xml_base)); base_name = os.path.splitext(os.path.basename(xml_base))[0]
         ext = os.path.splitext(xml_base)[1] or ".xml"; os.makedirs(output_dir, exist_ok=True)
@@ -398,42 +511,44 @@ def run_processing(csv_file, xml_base, default_location, category, username,
     if total_rows_to_process == 0: logging.info("No data rows to process."); return mapping
     batch_size = max(1, batch_size); total_batches = (total_rows_to_process + batch_size - 1) // batch_size
     logging.info(f"Processing {total_rows_to_process} objects (estimated {total_batches} batches)...")
-    rename_list = []; batch_nodes_with_ids = []; batch_count = 0; node_type_counts = {}
+    rename_list = {}; batch_nodes_with_ids = []; batch_count = 0; node_type_counts = {}
     processed_count = 0; skipped_count = 0; error_count = 0; current_batch_file_path = ""
-    for i, db_object_info in enumerate(objects_for_db):
+    for db_object_info in objects_for_db:
         unique_id = db_object_info['unique_id']; csv_data = db_object_info['csv_data']; row_num = db_object_info['csv_row_index']
         if stop_flag_func and stop_flag_func(): logging.warning(f"Stop requested. Halting before object {unique_id} (Row {row_num})."); break
-        current_db_status = db_handler.get_object_status(unique_id); status_val = current_db_status.get('status') if current_db_status else 'unknown'
+        status_val = db_statuses.get(unique_id, 'unknown')
         if status_val == 'success' and not force_reprocess: logging.info(f"Skipping object {unique_id} (Row {row_num}): Status 'success'."); skipped_count += 1; continue
         elif status_val == 'processing': logging.warning(f"Object {unique_id} (Row {row_num}) has status 'processing'. Attempting to re-process.")
         elif status_val == 'unknown': logging.error(f"Object {unique_id} (Row {row_num}) not found in DB after initial add. Skipping."); skipped_count += 1; continue
-        db_handler.update_object_status(unique_id, 'processing'); logging.debug(f"Processing object {unique_id} (Row {row_num})...")
-        node_elem, error_msg = process_row(row_index=row_num, csv_data=csv_data, mapping=mapping, default_location=default_location, username=username, selected_action=action, default_node_type=node_type, category_default=category, use_csv_createdby=use_csv_createdby, report_dict=report_dict, rename_list=rename_list, special_map=DEFAULT_SPECIAL_CHAR_MAP, cleansing_options=cleansing_options or {}, cleansing_callback=cleansing_callback)
+        logging.debug(f"Processing object {unique_id} (Row {row_num})...") # Final status is written with the batch below
+        node_elem, error_msg = process_row(row_index=row_num, csv_data=csv_data, mapping=mapping, default_location=default_location, username=username, selected_action=action, default_node_type=node_type, category_default=category, use_csv_createdby=use_csv_createdby, report_dict=report_dict, rename_list=rename_list, special_map=DEFAULT_SPECIAL_CHAR_MAP, cleansing_options=cleansing_options or {}, cleansing_callback=cleansing_callback, mapping_plan=mapping_plan)
         if node_elem is not None:
             processed_count += 1; node_type_res = node_elem.attrib.get("type", "unknown"); action_res = node_elem.attrib.get("action", "unknown")
             identifier_res = node_elem.findtext("title", default="").strip() or node_elem.findtext("location", default="").strip() or f"Row_{row_num}_Object"
-            generated_xml_str = ET.tostring(node_elem, encoding='unicode'); node_type_counts[node_type_res] = node_type_counts.get(node_type_res, 0) + 1
+            node_type_counts[node_type_res] = node_type_counts.get(node_type_res, 0) + 1
             batch_nodes_with_ids.append((node_elem, unique_id))
-            db_updates_batch.append({'unique_id': unique_id, 'status': 'success', 'node_type': node_type_res, 'action': action_res, 'identifier': identifier_res, 'generated_xml': generated_xml_str, 'error_message': None, 'output_batch_file': None })
+            # generated_xml is filled in from write_xml_batch so each node is only serialized once.
+            db_updates_batch.append({'unique_id': unique_id, 'status': 'success', 'node_type': node_type_res, 'action': action_res, 'identifier': identifier_res, 'generated_xml': None, 'error_message': None, 'output_batch_file': None })
         else:
             error_count += 1
             db_updates_batch.append({'unique_id': unique_id, 'status': 'failed', 'error_message': error_msg, 'generated_xml': None })
-        is_last_item = (i + 1) == total_rows_to_process
-        if batch_nodes_with_ids and (len(batch_nodes_with_ids) >= batch_size or is_last_item):
+        if len(batch_nodes_with_ids) >= batch_size:
             batch_count += 1
             current_batch_file_path = os.path.join(output_dir, f"{base_name}_{batch_count}{ext}")
-            ids_in_batch = write_xml_batch(batch_nodes_with_ids, current_batch_file_path, cdata_fields)
-            if ids_in_batch:
-                for update_item in db_updates_batch:
-                    if update_item['unique_id'] in ids_in_batch and update_item['status'] == 'success':
-                        update_item['output_batch_file'] = current_batch_file_path
-            batch_nodes_with_ids.clear() 
-    if db_updates_batch:
-        logging.info(f"Performing batch database update for {len(db_updates_batch)} objects...")
-        updated_db_rows, failed_db_updates = db_handler.batch_update_object_statuses(db_updates_batch)
-        logging.info(f"Batch DB update complete. Successfully updated rows (approx): {updated_db_rows}, Failed/Not Found: {failed_db_updates}")
+            write_batch_and_update_db(batch_count, batch_nodes_with_ids, db_updates_batch, current_batch_file_path, cdata_fields)
+            batch_nodes_with_ids.clear(); db_updates_batch.clear()
+    if batch_nodes_with_ids:
+        # The partial last batch, including nodes built before a stop request, is written before its
+        # 'success' statuses are stored, so those rows keep their generated_xml and output file.
+        batch_count += 1
+        current_batch_file_path = os.path.join(output_dir, f"{base_name}_{batch_count}{ext}")
+        write_batch_and_update_db(batch_count, batch_nodes_with_ids, db_updates_batch, current_batch_file_path, cdata_fields)
+        batch_nodes_with_ids.clear(); db_updates_batch.clear()
+    elif db_updates_batch:
+        # Remaining updates: failures after the last written batch.
+        logging.info(f"Performing final database update for {len(db_updates_batch)} objects...")
+        write_batch_and_update_db(None, [], db_updates_batch, None, cdata_fields)
         db_updates_batch.clear()
-    else: logging.info("No database updates to batch process.")
     logging.info("--- Processing Run Finished ---"); logging.info(f"Total objects from CSV: {total_rows_to_process}"); logging.info(f"Successfully processed & batched for XML: {processed_count}"); logging.info(f"Skipped (due to prior success/force_reprocess=False): {skipped_count}"); logging.info(f"Processing errors: {error_count}"); logging.info(f"Total XML batches written: {batch_count}"); logging.info(f"Node type counts (for successful): {json.dumps(node_type_counts)}")
     if rename_list and not use_report_for_file:
         rename_script_path = generate_rename_script(rename_list, output_dir)
@@ -443,148 +558,134 @@ def run_processing(csv_file, xml_base, default_location, category, username,
 
 # -------------------- Reprocess-Related Functions (Updated for XML -> DB workflow) --------------------
 # ... (save_reprocessed_nodes remains as original) ...
-def save_reprocessed_nodes(reprocess_data, output_path):
-    root = ET.Element("import"); nodes_added = 0; processed_ids = []
-    for item in reprocess_data:
-        action_val = item.get('action_state', 'Skip')
-        if action_val == 'Re-import':
-            try:
-                node_xml_str = item.get('generated_xml')
-                if not node_xml_str: logging.warning(f"Skipping reprocess for {item.get('unique_id')}: Regenerated XML is missing."); continue
-                node_elem = ET.fromstring(node_xml_str); root.append(node_elem); nodes_added += 1; processed_ids.append(item.get('unique_id'))
-            except Exception as e: logging.exception(f"Error adding node to reprocess XML (ID: {item.get('unique_id','N/A')})")
-    if nodes_added == 0: logging.warning(f"No nodes marked for 'Re-import' found. Reprocess XML not generated: {output_path}"); return [], False
+def save_reprocessed_nodes(reprocess_data, output_path, validate=False):
+    """
+    Writes the 'Re-import' items' generated_xml into one <import> file.
+    The node XML is spliced in as-is (it was produced by this program); pass validate=True to parse-check each node first.
+    Nodes are streamed to a temporary file that replaces output_path only once it is complete.
+    """
+    processed_ids = []; temp_path = output_path + ".tmp"
     try:
-        tree = ET.ElementTree(root); tree.write(output_path, encoding="utf-8", xml_declaration=True)
-        logging.info(f"Reprocess XML with {nodes_added} nodes saved to: {output_path}"); return processed_ids, True
-    except Exception as e: logging.exception(f"Failed to write reprocess XML to {output_path}"); return [], False
+        with open(temp_path, "wb") as f:
+            f.write(b"<?xml version='1.0' encoding='utf-8'?>\n<import>")
+            for item in reprocess_data:
+                action_val = item.get('action_state', 'Skip')
+                if action_val == 'Re-import':
+                    node_xml = item.get('generated_xml')
+                    if not node_xml: logging.warning(f"Skipping reprocess for {item.get('unique_id')}: Regenerated XML is missing."); continue
+                    if isinstance(node_xml, str): node_xml = node_xml.encode('utf-8')
+                    if validate:
+                        try: ET.fromstring(node_xml)
+                        except ET.ParseError: logging.exception(f"Error adding node to reprocess XML (ID: {item.get('unique_id','N/A')})"); continue
+                    f.write(node_xml); processed_ids.append(item.get('unique_id'))
+            f.write(b"</import>")
+        if not processed_ids: os.remove(temp_path); logging.warning(f"No nodes marked for 'Re-import' found. Reprocess XML not generated: {output_path}"); return [], False
+        os.replace(temp_path, output_path)
+        logging.info(f"Reprocess XML with {len(processed_ids)} nodes saved to: {output_path}"); return processed_ids, True
+    except Exception as e:
+        logging.exception(f"Failed to write reprocess XML to {output_path}")
+        try: os.remove(temp_path)
+        except OSError: pass
+        return [], False
 
 # -------------------- XML to CSV Conversion Functionality --------------------
 
+FIELD_TREE_MAX_ROWS = 15 # Visible rows of a node's field list; longer lists scroll
+CHECKED_GLYPH, UNCHECKED_GLYPH = "\u2611", "\u2610"
+
 class FieldSelectionDialog(simpledialog.Dialog):
     def __init__(self, parent, title, available_fields_by_node):
         self.available_fields_by_node = available_fields_by_node
         self.result = None
-        self.checkbutton_vars = {} # Store {node_tag: {field_name: tk.BooleanVar}}
+        self.checked_fields = {} # Store {node_tag: set of checked field names}
+        self.field_trees = {} # Store {node_tag: ttk.Treeview listing that node's fields}, built on first view
+        self.node_frames = {} # Store {node_tag: frame shown in the right-hand pane}
         super().__init__(parent, title)
 
     def body(self, master):
         master.pack(fill="both", expand=True)
-        canvas = tk.Canvas(master, borderwidth=0)
-        scrollbar = ttk.Scrollbar(master, orient="vertical", command=canvas.yview)
-        scrollable_frame = ttk.Frame(canvas)
-
-        scrollable_frame.bind(
-            "<Configure>",
-            lambda e: canvas.configure(scrollregion=canvas.bbox("all"))
-        )
-        canvas.create_window((0, 0), window=scrollable_frame, anchor="nw")
-        canvas.configure(yscrollcommand=scrollbar.set)
-
-        row_idx = 0
-        for node_tag, fields in sorted(self.available_fields_by_node.items()):
-            if not fields: continue # Skip node tags if no fields were found (e.g. self-closing tags)
-
-            self.checkbutton_vars[node_tag] = {}
-
-            node_frame = ttk.LabelFrame(scrollable_frame, text=f"Fields for <{node_tag}> elements", padding=(10,5))
-            node_frame.grid(row=row_idx, column=0, padx=10, pady=5, sticky="ew")
-            row_idx += 1
-
-            select_all_var = tk.BooleanVar(value=True)
-            select_all_cb = ttk.Checkbutton(node_frame, text="Select/Deselect All", variable=select_all_var,
-                                            command=lambda nt=node_tag, sv=select_all_var: self.toggle_all_for_node(nt, sv.get()))
-            select_all_cb.grid(row=0, column=0, columnspan=2, sticky="w", pady=(0,5))
-
-            field_idx = 0
-            max_cols = 3 # Display fields in N columns
-            for field_name in sorted(list(fields)):
-                var = tk.BooleanVar(value=True)
-                self.checkbutton_vars[node_tag][field_name] = var
-                cb = ttk.Checkbutton(node_frame, text=field_name, variable=var)
-                cb.grid(row=1 + field_idx // max_cols, column=field_idx % max_cols, sticky="w", padx=5)
-                field_idx += 1
-
-        canvas.pack(side="left", fill="both", expand=True)
-        scrollbar.pack(side="right", fill="y")
-        return None # focus_set is handled by simpledialog.Dialog
+        # Skip node tags if no fields were found (e.g. self-closing tags). Every field starts checked.
+        self.node_tags = [node_tag for node_tag, fields in sorted(self.available_fields_by_node.items()) if fields]
+        self.checked_fields = {node_tag: set(self.available_fields_by_node[node_tag]) for node_tag in self.node_tags}
+
+        ttk.Label(master, text="Element types:").grid(row=0, column=0, sticky="w", padx=(10,5))
+        node_list = tk.Listbox(master, exportselection=False, width=24, height=min(max(len(self.node_tags), 5), 15))
+        for node_tag in self.node_tags: node_list.insert("end", f"<{node_tag}>")
+        node_list.grid(row=1, column=0, sticky="ns", padx=(10,5), pady=5)
+        node_list.bind("<<ListboxSelect>>", lambda e: self.show_node(self.node_tags[node_list.curselection()[0]]) if node_list.curselection() else None)
+
+        self.node_pane = ttk.Frame(master)
+        self.node_pane.grid(row=0, column=1, rowspan=2, sticky="nsew", padx=(5,10), pady=5)
+        self.current_node_tag = None
+        if self.node_tags: node_list.selection_set(0); self.show_node(self.node_tags[0])
+        return node_list
+
+    def show_node(self, node_tag):
+        """Shows the field list for node_tag in the right-hand pane, building it on first view."""
+        if node_tag == self.current_node_tag: return
+        if self.current_node_tag is not None: self.node_frames[self.current_node_tag].grid_remove()
+        if node_tag not in self.node_frames: self.node_frames[node_tag] = self.build_node_frame(node_tag)
+        self.node_frames[node_tag].grid(row=0, column=0, sticky="nsew")
+        self.current_node_tag = node_tag
+
+    def build_node_frame(self, node_tag):
+        fields = self.available_fields_by_node[node_tag]
+        node_frame = ttk.LabelFrame(self.node_pane, text=f"Fields for <{node_tag}> elements", padding=(10,5))
+
+        select_all_var = tk.BooleanVar(value=self.checked_fields[node_tag] == set(fields))
+        select_all_cb = ttk.Checkbutton(node_frame, text="Select/Deselect All", variable=select_all_var,
+                                        command=lambda nt=node_tag, sv=select_all_var: self.toggle_all_for_node(nt, sv.get()))
+        select_all_cb.grid(row=0, column=0, columnspan=2, sticky="w", pady=(0,5))
+
+        # One Treeview per node tag instead of a Checkbutton per field; clicking a row toggles its glyph
+        tree = ttk.Treeview(node_frame, show="tree", selectmode="none", height=min(len(fields), FIELD_TREE_MAX_ROWS))
+        tree.column("#0", width=420, stretch=True)
+        for field_name in sorted(fields):
+            tree.insert("", "end", iid=field_name, text=f"{CHECKED_GLYPH if field_name in self.checked_fields[node_tag] else UNCHECKED_GLYPH} {field_name}")
+        tree.bind("<Button-1>", lambda e, nt=node_tag, tv=tree: self.toggle_field(nt, tv.identify_row(e.y)))
+        tree.grid(row=1, column=0, columnspan=2, sticky="ew")
+        if len(fields) > FIELD_TREE_MAX_ROWS:
+            tree_scrollbar = ttk.Scrollbar(node_frame, orient="vertical", command=tree.yview)
+            tree.configure(yscrollcommand=tree_scrollbar.set); tree_scrollbar.grid(row=1, column=2, sticky="ns")
+        self.field_trees[node_tag] = tree
+        return node_frame
+
+    def toggle_field(self, node_tag, field_name):
+        if not field_name: return # Click below the last row
+        checked = self.checked_fields[node_tag]
+        if field_name in checked: checked.discard(field_name)
+        else: checked.add(field_name)
+        self.field_trees[node_tag].item(field_name, text=f"{CHECKED_GLYPH if field_name in checked else UNCHECKED_GLYPH} {field_name}")
 
     def toggle_all_for_node(self, node_tag, select_state):
-        if node_tag in self.checkbutton_vars:
-            for field_name, var in self.checkbutton_vars[node_tag].items():
-                var.set(select_state)
+        if node_tag in self.checked_fields:
+            tree = self.field_trees[node_tag]; checked = self.checked_fields[node_tag]
+            checked.clear()
+            if select_state: checked.update(tree.get_children())
+            glyph = CHECKED_GLYPH if select_state else UNCHECKED_GLYPH
+            for field_name in tree.get_children(): tree.item(field_name, text=f"{glyph} {field_name}")
 
     def apply(self):
         self.result = {}
-        for node_tag, field_vars in self.checkbutton_vars.items():
-            self.result[node_tag] = [field_name for field_name, var in field_vars.items() if var.get()]
+        for node_tag, checked in self.checked_fields.items():
+            self.result[node_tag] = sorted(checked)
         logging.info(f"Field selections made: {self.result}")
 
-def get_all_fields_from_xml_root(xml_root):
+def get_all_fields_from_xml_file(xml_path):
     """
-    Parses an XML root to find all unique top-level element tags and their possible fields.
-    Fields include attributes and child tags (and their attributes, formatted).
+    Streams the file with ET.iterparse and returns (available_fields_by_node, parsed_records).
+    available_fields_by_node maps each top-level tag to 'element_tag' plus every field element_to_record
+    finds on such elements; parsed_records holds one (tag, record) tuple per top-level element for
+    write_records_csv, so the file is parsed once.
+    Each top-level element is discarded once harvested, so the whole tree is never held.
     """
-    available_fields_by_node = {}
-
-    for element in xml_root: # Iterate over top-level elements (like <folder>, <document>)
-        tag_name = element.tag
-        if tag_name not in available_fields_by_node:
-            available_fields_by_node[tag_name] = set()
-
-        # Always consider 'element_tag' as a potential field
-        available_fields_by_node[tag_name].add('element_tag')
-
-        # Handle simple folder wrapper structure specifically for field discovery
-        is_simple_folder_wrapper = False
-        if element.tag == 'folder':
-            folder_children = list(element)
-            if len(folder_children) == 1 and folder_children[0].tag == 'node':
-                is_simple_folder_wrapper = True
-                inner_node = folder_children[0]
-                for attr_name in inner_node.attrib:
-                    available_fields_by_node[tag_name].add(attr_name)
-                for folder_prop_child in inner_node:
-                    prop_child_tag_name = folder_prop_child.tag
-                    for prop_attr_name in folder_prop_child.attrib:
-                        available_fields_by_node[tag_name].add(f"{prop_child_tag_name}_{prop_attr_name}")
-                    if folder_prop_child.text and folder_prop_child.text.strip():
-                         available_fields_by_node[tag_name].add(prop_child_tag_name)
-
-        if not is_simple_folder_wrapper:
-            # Direct attributes of the element
-            for attr_name in element.attrib:
-                available_fields_by_node[tag_name].add(attr_name)
-
-            # Children of the element
-            for child in element:
-                child_tag_name = child.tag
-                # Attributes of children
-                for attr_name in child.attrib:
-                    if child_tag_name == 'category' and attr_name == 'name': continue
-                    if child_tag_name == 'rmclassification' and attr_name == 'name':
-                         available_fields_by_node[tag_name].add(f"rmclassification_{attr_name}")
-                         continue
-                    if child_tag_name == 'attribute' and attr_name == 'name': continue
-                    if child_tag_name == 'acl': continue
-                    available_fields_by_node[tag_name].add(f"{child_tag_name}_{attr_name}")
-
-                # Specific handling for complex children
-                if child_tag_name == 'category':
-                    category_name_attr = child.attrib.get('name', 'UnknownCategory')
-                    sane_category_name = "".join(c if c.isalnum() else '_' for c in category_name_attr)
-                    for cat_attr_elem in child.findall('attribute'):
-                        attr_name_for_header = cat_attr_elem.attrib.get('name')
-                        if attr_name_for_header:
-                            available_fields_by_node[tag_name].add(f"category_{sane_category_name}_{attr_name_for_header}")
-                elif child_tag_name == 'rmclassification':
-                    for rm_child in child: # Children of rmclassification
-                        available_fields_by_node[tag_name].add(f"rmclassification_{rm_child.tag}")
-                elif child.text and child.text.strip(): # Simple child with text
-                    available_fields_by_node[tag_name].add(child_tag_name)
-
-    return available_fields_by_node
-
+    available_fields_by_node = {}; parsed_records = []
+    for elem in iter_top_level_elements(xml_path):
+        record = element_to_record(elem)
+        parsed_records.append((elem.tag, record))
+        # The record's keys are the selectable fields, so discovery and conversion share element_to_record's rules
+        available_fields_by_node.setdefault(elem.tag, {'element_tag'}).update(record)
+    return available_fields_by_node, parsed_records
 
 def perform_xml_to_csv_conversion(app_instance):
     if not convert_xml_to_csv:
@@ -594,11 +695,8 @@ def perform_xml_to_csv_conversion(app_instance):
     if not xml_input_path: logging.info("XML to CSV conversion cancelled by user (no input file selected)."); return
 
     try:
-        logging.info(f"Reading XML file for field discovery: {xml_input_path}")
-        with open(xml_input_path, 'r', encoding='utf-8') as f_xml: xml_content = f_xml.read()
-
-        xml_root = ET.fromstring(xml_content)
-        available_fields = get_all_fields_from_xml_root(xml_root)
+        logging.info(f"Streaming XML file for field discovery: {xml_input_path}")
+        available_fields, parsed_records = get_all_fields_from_xml_file(xml_input_path)
 
         if not available_fields:
             messagebox.showinfo("Info", "No processable elements found in the XML or XML is empty.")
@@ -606,6 +704,7 @@ def perform_xml_to_csv_conversion(app_instance):
 
         dialog = FieldSelectionDialog(app_instance, "Select XML Fields to Convert", available_fields)
         selected_fields_by_node = dialog.result # This will be None if cancelled, or a dict if OK
+        del available_fields, dialog # Only the selection and the cached records are needed from here
 
         if selected_fields_by_node is None:
             logging.info("XML to CSV conversion cancelled by user (field selection dialog).")
@@ -615,12 +714,11 @@ def perform_xml_to_csv_conversion(app_instance):
         if not csv_output_path: logging.info("XML to CSV conversion cancelled by user (no output file selected)."); return
 
         logging.info("Starting XML to CSV conversion with selected fields...")
-        csv_content = convert_xml_to_csv(xml_content, selected_fields_by_node)
+        logging.info(f"Writing CSV output to: {csv_output_path}")
+        with open(csv_output_path, 'w', encoding='utf-8', newline='') as f_csv: wrote_csv = write_records_csv(parsed_records, selected_fields_by_node, f_csv)
+        del parsed_records
 
-        if csv_content.startswith("Error:"):
-            logging.error(f"Conversion failed: {csv_content}"); messagebox.showerror("Conversion Error", f"Could not convert XML to CSV:\n{csv_content}"); return
-
-        if not csv_content.strip() and selected_fields_by_node:
+        if not wrote_csv and selected_fields_by_node:
              # Check if any fields were selected for any node. If selections were made but output is empty.
             is_any_field_selected = any(fields for fields in selected_fields_by_node.values())
             if is_any_field_selected:
@@ -628,9 +726,6 @@ def perform_xml_to_csv_conversion(app_instance):
             else: # No fields were selected at all
                  messagebox.showinfo("Conversion Note", "CSV conversion resulted in empty output as no fields were selected for export.")
 
-
-        logging.info(f"Saving CSV output to: {csv_output_path}")
-        with open(csv_output_path, 'w', encoding='utf-8', newline='') as f_csv: f_csv.write(csv_content)
         logging.info("XML to CSV conversion successful."); messagebox.showinfo("Conversion Successful", f"XML file converted and saved to:\n{csv_output_path}")
 
     except ET.ParseError as e:
@@ -643,6 +738,13 @@ def perform_xml_to_csv_conversion(app_instance):
         logging.exception("Error during XML to CSV conversion.")
         messagebox.showerror("Conversion Error", f"An unexpected error occurred:\n{str(e)}")
 
+CONFIG_SAVE_TIMEOUT_SECONDS = 1.0  # How long closing the window waits for the fallback config to be written.
+CLEANSING_VIEW_MAX_ROWS = 5000  # Older rows are dropped from the Cleansing tab (the log file keeps every change).
+MAPPING_TYPES = ["Ignore", "Standard", "Metadata"]
+MAPPING_TREE_COLUMNS = ("col", "type", "target", "category")
+MAPPING_TREE_EDIT_KEYS = {"#2": "MappingType", "#3": "TargetLabel", "#4": "Category"} # Treeview column id -> csv_mapping_entries key
+_UNCREATED_ERROR_RE = re.compile(r"<!-- Error:(.*)-->") # Error comment preceding each node of an _uncreated.xml
+
 # -------------------- Tkinter Application (Updated Reprocess Logic) --------------------
 class Application(tk.Tk):
     def __init__(self):
@@ -673,8 +775,8 @@ class Application(tk.Tk):
         self._stop_requested = False; self._processing_thread = None
         self.current_project_path = None; self.db_available = False
         self.force_reprocess_var = tk.BooleanVar(value=False); self.mapping_dirty = tk.BooleanVar(value=False)
-        self.cleansing_events = []
-        self.cleansing_queue = queue.Queue()
+        self.cleansing_events = collections.deque(maxlen=CLEANSING_VIEW_MAX_ROWS) # Most recent cleansing events, oldest evicted first
+        self.cleansing_queue = queue.SimpleQueue()
         
         self.notebook = ttk.Notebook(self)
         self.log_frame = ttk.Frame(self.notebook)
@@ -778,7 +880,12 @@ class Application(tk.Tk):
         self.reprocess_frame = ttk.Frame(self.notebook); self.notebook.add(self.reprocess_frame, text="Reprocess"); self.create_reprocess_tab(self.reprocess_frame)
         self.cleansing_frame = ttk.Frame(self.notebook); self.notebook.add(self.cleansing_frame, text="Data Cleansing"); self.create_cleansing_tab(self.cleansing_frame)
         self.notebook.add(self.log_frame, text="Log Output")
-        self.after(200, self.flush_cleansing_queue)
+        self.after(200, self.flush_cleansing_queue); self.after(500, self.prewarm_file_dialogs)
+    def prewarm_file_dialogs(self):
+        # An invalid option makes Tk load the file dialog's implementation (the Tcl dialog scripts on X11)
+        # and then reject the call, so the first Browse click doesn't pay for that load.
+        try: self.tk.call('tk_getOpenFile', '-help')
+        except tk.TclError: pass
     def create_settings_tab(self, frame):
         frame.columnconfigure(0, weight=1)
         essential_frame = ttk.LabelFrame(frame, text="Essential Project Setup", padding=(10, 5)); essential_frame.grid(row=0, column=0, sticky="ew", padx=10, pady=(5, 7)); essential_frame.columnconfigure(1, weight=1)
@@ -810,57 +917,60 @@ class Application(tk.Tk):
         self.report_button = ttk.Button(action_btn_frame, text="View Status Report", command=self.view_status_report, width=20, state=tk.NORMAL if self.db_available else tk.DISABLED); self.report_button.grid(row=0, column=2, padx=10, pady=5, sticky="w")
         project_btn_frame = ttk.Frame(frame, padding=(10, 5)) ; project_btn_frame.grid(row=4, column=0, sticky="ew", padx=10, pady=(0,5)) ; project_btn_frame.columnconfigure(0, weight=1); project_btn_frame.columnconfigure(1, weight=1)
         ttk.Button(project_btn_frame, text="Open Project...", command=self.open_project, width=20).grid(row=0, column=0, padx=10, pady=5, sticky="e"); ttk.Button(project_btn_frame, text="Save Project...", command=self.save_project, width=20).grid(row=0, column=1, padx=10, pady=5, sticky="w")
-    def create_csv_mapping_tab(self, frame): # as original
+    def on_mapping_changed(self, *args): self.mapping_dirty.set(True)
+    def update_mapping_status_label(self): # Called by the trace on mapping_dirty
+        if hasattr(self, 'mapping_status_label'): self.mapping_status_label.config(text="* Unsaved changes" if self.mapping_dirty.get() else "", foreground="red")
+    def create_csv_mapping_tab(self, frame):
         top_frame = ttk.Frame(frame, padding=(10, 5)); top_frame.pack(fill="x")
         ttk.Button(top_frame, text="Load CSV Header", command=self.populate_csv_mapping_tab).pack(side="left", padx=5)
         ttk.Button(top_frame, text="Save Column Mappings", command=self.save_csv_mapping_tab).pack(side="left", padx=5) 
         self.mapping_status_label = ttk.Label(top_frame, text="", foreground="red") ; self.mapping_status_label.pack(side="left", padx=10, pady=2)
         self.mapping_dirty.trace_add('write', lambda *args: self.update_mapping_status_label())
-        canvas_frame = ttk.Frame(frame); canvas_frame.pack(fill="both", expand=True, padx=10, pady=(5, 10)) 
-        self.csv_mapping_canvas = tk.Canvas(canvas_frame); self.csv_mapping_scroll = ttk.Scrollbar(canvas_frame, orient="vertical", command=self.csv_mapping_canvas.yview); self.csv_mapping_inner = ttk.Frame(self.csv_mapping_canvas)
-        self.csv_mapping_canvas.configure(yscrollcommand=self.csv_mapping_scroll.set); self.csv_mapping_scroll.pack(side="right", fill="y"); self.csv_mapping_canvas.pack(side="left", fill="both", expand=True)
-        self.csv_mapping_canvas_window = self.csv_mapping_canvas.create_window((0, 0), window=self.csv_mapping_inner, anchor="nw")
-        self.csv_mapping_inner.bind("<Configure>", self._on_mapping_configure); self.csv_mapping_canvas.bind("<Configure>", self._on_canvas_configure)
-        self.mapping_instruction_label = ttk.Label(self.csv_mapping_inner, text="") ; self.mapping_instruction_label.grid(row=0, column=0, sticky="ew", padx=5, pady=5)
-        header_frame = ttk.Frame(self.csv_mapping_inner); header_frame.grid(row=1, column=0, sticky="ew", pady=(0,2)) 
-        ttk.Label(header_frame, text="CSV Column", borderwidth=1, relief="solid", anchor="center").grid(row=0, column=0, sticky="ew", padx=1, pady=1); ttk.Label(header_frame, text="Mapping Type", borderwidth=1, relief="solid", anchor="center").grid(row=0, column=1, sticky="ew", padx=1, pady=1); ttk.Label(header_frame, text="Target Label", borderwidth=1, relief="solid", anchor="center").grid(row=0, column=2, sticky="ew", padx=1, pady=1); ttk.Label(header_frame, text="Category", borderwidth=1, relief="solid", anchor="center").grid(row=0, column=3, sticky="ew", padx=1, pady=1); ttk.Label(header_frame, text="Select Cat.", borderwidth=1, relief="solid", anchor="center").grid(row=0, column=4, sticky="ew", padx=1, pady=1)
-        header_frame.columnconfigure(0, weight=3); header_frame.columnconfigure(1, weight=2); header_frame.columnconfigure(2, weight=3); header_frame.columnconfigure(3, weight=3); header_frame.columnconfigure(4, weight=1)
-        self.csv_mapping_entries = []; self.csv_mapping_rows_frame = ttk.Frame(self.csv_mapping_inner); self.csv_mapping_rows_frame.grid(row=2, column=0, sticky="ew")
-        self.csv_mapping_rows_frame.columnconfigure(0, weight=3); self.csv_mapping_rows_frame.columnconfigure(1, weight=2); self.csv_mapping_rows_frame.columnconfigure(2, weight=3); self.csv_mapping_rows_frame.columnconfigure(3, weight=3); self.csv_mapping_rows_frame.columnconfigure(4, weight=1)
-    def _on_mapping_configure(self, event): self.csv_mapping_canvas.configure(scrollregion=self.csv_mapping_canvas.bbox("all")) # as original
-    def _on_canvas_configure(self, event): canvas_width = event.width; self.csv_mapping_canvas.itemconfig(self.csv_mapping_canvas_window, width=canvas_width) # as original
+        self.mapping_instruction_label = ttk.Label(frame, text="") ; self.mapping_instruction_label.pack(fill="x", padx=15, pady=(0,5))
+        tree_frame = ttk.Frame(frame); tree_frame.pack(fill="both", expand=True, padx=10, pady=(0, 10))
+        self.mapping_tree = ttk.Treeview(tree_frame, columns=MAPPING_TREE_COLUMNS, show="headings", selectmode="browse")
+        for col_id, heading, width in zip(MAPPING_TREE_COLUMNS, ("CSV Column", "Mapping Type", "Target Label", "Category"), (200, 120, 200, 250)): self.mapping_tree.heading(col_id, text=heading); self.mapping_tree.column(col_id, width=width, anchor="w")
+        tree_scroll = ttk.Scrollbar(tree_frame, orient="vertical", command=self.mapping_tree.yview); self.mapping_tree.configure(yscrollcommand=tree_scroll.set); tree_scroll.pack(side="right", fill="y"); self.mapping_tree.pack(side="left", fill="both", expand=True)
+        self.mapping_tree.bind("<Double-1>", self.on_mapping_tree_double_click)
+        self.csv_mapping_entries = [] # One {"Column", "MappingType", "TargetLabel", "Category"} dict per CSV column; tree iids are list indexes
     def populate_csv_mapping_tab(self): # as original (with correct dialect handling)
-        for widget in self.csv_mapping_rows_frame.winfo_children(): widget.destroy()
-        self.csv_mapping_entries.clear(); header_children = self.csv_mapping_inner.grid_slaves(row=1) ; header_frame_widget = header_children[0] if header_children else None; csv_path = self.csv_file.get()
-        if not csv_path or not os.path.exists(csv_path): self.mapping_instruction_label.config(text="Please load a CSV file from the 'Settings' tab to view and configure column mappings.", foreground="blue"); (header_frame_widget.grid_remove() if header_frame_widget else None); self.mapping_dirty.set(False); return
-        self.mapping_instruction_label.config(text="Review and adjust the mappings below. Click 'Save Column Mappings' when done.", foreground="black"); (header_frame_widget.grid() if header_frame_widget else None)
+        self.mapping_tree.delete(*self.mapping_tree.get_children()); self.csv_mapping_entries.clear(); csv_path = self.csv_file.get()
+        if not csv_path or not os.path.exists(csv_path): self.mapping_instruction_label.config(text="Please load a CSV file from the 'Settings' tab to view and configure column mappings.", foreground="blue"); self.mapping_dirty.set(False); return
+        self.mapping_instruction_label.config(text="Review and adjust the mappings below (double-click a cell to edit). Click 'Save Column Mappings' when done.", foreground="black")
         try:
-            with open(csv_path, "r", encoding="utf-8-sig") as f: sample = f.read(2048); f.seek(0); dialect = None
-            if self.csv_delimiter.get(): dialect = type('CustomDialect', (csv.Dialect,), {'delimiter': self.csv_delimiter.get(), 'quotechar': self.csv_quotechar.get() or '"', 'doublequote': True, 'skipinitialspace': True, 'lineterminator': "\r\n", 'quoting': csv.QUOTE_MINIMAL})()
-            else:
-                try: dialect = csv.Sniffer().sniff(sample, delimiters=[',', ';', '\t', '|'])
-                except csv.Error: dialect = csv.excel
-            reader = csv.reader(f, dialect=dialect); headers = next(reader)
-        except StopIteration: self.mapping_instruction_label.config(text=f"CSV file '{os.path.basename(csv_path)}' appears to be empty or has no headers.", foreground="orange red"); (header_frame_widget.grid_remove() if header_frame_widget else None); self.mapping_dirty.set(False); return
-        except Exception as e: self.mapping_instruction_label.config(text=f"Error reading CSV: {e}", foreground="red"); (header_frame_widget.grid_remove() if header_frame_widget else None); logging.exception(f"Error reading CSV header from {csv_path}"); self.mapping_dirty.set(False); return
-        row_idx = 0
-        for col_header in headers:
+            with open(csv_path, "r", encoding="utf-8-sig", newline="") as f: headers = next(csv.reader(f, dialect=detect_csv_dialect(f, self.csv_delimiter.get(), self.csv_quotechar.get())))
+        except StopIteration: self.mapping_instruction_label.config(text=f"CSV file '{os.path.basename(csv_path)}' appears to be empty or has no headers.", foreground="orange red"); self.mapping_dirty.set(False); return
+        except Exception as e: self.mapping_instruction_label.config(text=f"Error reading CSV: {e}", foreground="red"); logging.exception(f"Error reading CSV header from {csv_path}"); self.mapping_dirty.set(False); return
+        for idx, col_header in enumerate(headers):
             original_col = col_header.strip(); norm_col = original_col.lower(); default_map = self.mapping.get(norm_col, {"MappingType": "Standard" if norm_col in RECOGNISED_STANDARD else "Metadata", "TargetLabel": original_col, "Category": ""})
-            lbl_col = ttk.Label(self.csv_mapping_rows_frame, text=original_col, anchor="w"); lbl_col.grid(row=row_idx, column=0, sticky="ew", padx=5, pady=1)
-            cmb_map_type = ttk.Combobox(self.csv_mapping_rows_frame, values=["Ignore", "Standard", "Metadata"], width=12, state="readonly"); cmb_map_type.set(default_map.get("MappingType", "Metadata")); cmb_map_type.grid(row=row_idx, column=1, sticky="ew", padx=5, pady=1); cmb_map_type.bind("<<ComboboxSelected>>", self.on_mapping_changed)
-            ent_target = ttk.Entry(self.csv_mapping_rows_frame, width=20); ent_target.insert(0, default_map.get("TargetLabel", original_col)); ent_target.grid(row=row_idx, column=2, sticky="ew", padx=5, pady=1); ent_target.bind("<KeyRelease>", self.on_mapping_changed)
-            cat_var = tk.StringVar(); cat_var.set(default_map.get("Category", "")); cat_var.trace_add('write', self.on_mapping_changed)
-            cat_display_entry = ttk.Entry(self.csv_mapping_rows_frame, textvariable=cat_var, state="readonly", width=18); cat_display_entry.grid(row=row_idx, column=3, sticky="ew", padx=5, pady=1)
-            original_cat_val = cat_var.get() ; select_btn = ttk.Button(self.csv_mapping_rows_frame, text="...", width=3, command=lambda v=cat_var, ov=original_cat_val: self.open_category_selector(v, ov)); select_btn.grid(row=row_idx, column=4, sticky="w", padx=(0,5), pady=1)
-            self.csv_mapping_entries.append((norm_col, cmb_map_type, ent_target, cat_var)); row_idx += 1
-        self.csv_mapping_canvas.update_idletasks(); self.csv_mapping_canvas.configure(scrollregion=self.csv_mapping_canvas.bbox("all")); self.mapping_dirty.set(False)
-    def save_csv_mapping_tab(self): # as original
-        new_mapping = {};
-        for norm_col, cmb_map_type, ent_target, cat_var in self.csv_mapping_entries: mtype = cmb_map_type.get().strip(); target = ent_target.get().strip(); cat = cat_var.get().strip(); (new_mapping[norm_col] if mtype and target else logging.warning(f"Mapping ignored for CSV column '{norm_col}' due to missing Type or Target Label." if mtype != "Ignore" else None)) # this line is wrong
-        for norm_col, cmb_map_type, ent_target, cat_var in self.csv_mapping_entries:
-            mtype = cmb_map_type.get().strip(); target = ent_target.get().strip(); cat = cat_var.get().strip()
-            if mtype and target: new_mapping[norm_col] = {"MappingType": mtype, "TargetLabel": target, "Category": cat}
-            elif mtype != "Ignore": logging.warning(f"Mapping ignored for CSV column '{norm_col}' due to missing Type or Target Label.")
+            entry = {"Column": norm_col, "MappingType": default_map.get("MappingType", "Metadata"), "TargetLabel": default_map.get("TargetLabel", original_col), "Category": default_map.get("Category", "")}
+            self.csv_mapping_entries.append(entry); self.mapping_tree.insert("", "end", iid=str(idx), values=(original_col, entry["MappingType"], entry["TargetLabel"], entry["Category"]))
+        self.mapping_dirty.set(False)
+    def on_mapping_tree_double_click(self, event):
+        region = self.mapping_tree.identify("region", event.x, event.y); col_id = self.mapping_tree.identify_column(event.x); row_id = self.mapping_tree.identify_row(event.y)
+        if region == "cell" and row_id and col_id in MAPPING_TREE_EDIT_KEYS: self.edit_mapping_cell(row_id, col_id)
+    def edit_mapping_cell(self, row_id, col_id):
+        """Edits one mapping cell: a popup menu for the type, an in-place Entry for the label, the category selector for categories."""
+        key = MAPPING_TREE_EDIT_KEYS[col_id]; current_value = self.csv_mapping_entries[int(row_id)][key]
+        if key == "Category":
+            cat_var = tk.StringVar(value=current_value); self.open_category_selector(cat_var, current_value); self.set_mapping_cell(row_id, col_id, cat_var.get()); return
+        x, y, width, height = self.mapping_tree.bbox(row_id, col_id)
+        if key == "MappingType":
+            type_menu = tk.Menu(self.mapping_tree, tearoff=0)
+            for map_type in MAPPING_TYPES: type_menu.add_command(label=map_type, command=lambda t=map_type: self.set_mapping_cell(row_id, col_id, t))
+            type_menu.tk_popup(self.mapping_tree.winfo_rootx() + x, self.mapping_tree.winfo_rooty() + y + height); return
+        editor = ttk.Entry(self.mapping_tree); editor.place(x=x, y=y, width=width, height=height); editor.insert(0, current_value); editor.focus_set(); editor.selection_range(0, tk.END)
+        def save_edit(): (self.set_mapping_cell(row_id, col_id, editor.get()), editor.destroy()) if editor.winfo_exists() else None
+        editor.bind("<FocusOut>", lambda e: save_edit()); editor.bind("<Return>", lambda e: save_edit()); editor.bind("<Escape>", lambda e: editor.destroy())
+    def set_mapping_cell(self, row_id, col_id, value):
+        entry = self.csv_mapping_entries[int(row_id)]; key = MAPPING_TREE_EDIT_KEYS[col_id]
+        if value != entry[key]: entry[key] = value; self.mapping_tree.set(row_id, col_id, value); self.on_mapping_changed()
+    def save_csv_mapping_tab(self):
+        new_mapping = {}
+        for entry in self.csv_mapping_entries:
+            mtype = entry["MappingType"].strip(); target = entry["TargetLabel"].strip(); cat = entry["Category"].strip()
+            if mtype and target: new_mapping[entry["Column"]] = {"MappingType": mtype, "TargetLabel": target, "Category": cat}
+            elif mtype != "Ignore": logging.warning(f"Mapping ignored for CSV column '{entry['Column']}' due to missing Type or Target Label.")
         self.mapping = new_mapping; self.mapping_dirty.set(False); logging.info(f"CSV mapping updated and saved internally ({len(self.mapping)} rules)."); messagebox.showinfo("Mapping Saved", "Column mapping rules have been updated.\nRemember to save the project to persist these changes across sessions.")
     def open_category_selector(self, cat_var, original_value_for_var): # as original
         win = tk.Toplevel(self); win.title("Select Categories"); win.geometry("400x400"); win.transient(self); win.grab_set() 
@@ -868,8 +978,8 @@ class Application(tk.Tk):
         list_frame = ttk.Frame(win); list_frame.pack(fill="both", expand=True, padx=10, pady=5); cat_listbox = tk.Listbox(list_frame, selectmode=tk.MULTIPLE, exportselection=False)
         cat_scroll = ttk.Scrollbar(list_frame, orient="vertical", command=cat_listbox.yview); cat_listbox.config(yscrollcommand=cat_scroll.set); cat_scroll.pack(side="right", fill="y"); cat_listbox.pack(side="left", fill="both", expand=True)
         self.category_display_map = {simplify_category(c): c for c in self.categories}; display_categories = sorted(self.category_display_map.keys())
-        for item in display_categories: cat_listbox.insert(tk.END, item)
-        current_full_paths = [s.strip() for s in cat_var.get().split(",") if s.strip()]; current_simple_names = [simplify_category(fp) for fp in current_full_paths]
+        cat_listbox.insert(tk.END, *display_categories)
+        current_full_paths = [s.strip() for s in cat_var.get().split(",") if s.strip()]; current_simple_names = {simplify_category(fp) for fp in current_full_paths}
         for idx, simple_name in enumerate(display_categories):
             if simple_name in current_simple_names: cat_listbox.selection_set(idx)
         btn_frame = ttk.Frame(win); btn_frame.pack(pady=10)
@@ -932,21 +1042,16 @@ class Application(tk.Tk):
 
     def clear_cleansing_log(self):
         self.cleansing_events.clear()
-        while not self.cleansing_queue.empty():
-            try:
-                self.cleansing_queue.get_nowait()
-            except queue.Empty:
-                break
+        while True:
+            try: self.cleansing_queue.get_nowait()
+            except queue.Empty: break
         if hasattr(self, "cleansing_tree"):
-            for item_id in self.cleansing_tree.get_children():
-                self.cleansing_tree.delete(item_id)
+            self.cleansing_tree.delete(*self.cleansing_tree.get_children())
 
     def record_cleansing_action(self, stage, field, original, cleaned, row_index=None, details=""):
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        log_message = f"[Cleansing-{stage}] Row {row_index if row_index is not None else '-'} {field}: '{original}' -> '{cleaned}'"
-        if details:
-            log_message += f" ({details})"
-        logging.info(log_message)
+        timestamp = time.strftime("%H:%M:%S")
+        if logging.getLogger().isEnabledFor(logging.INFO): # Skip building the message when INFO is filtered out
+            logging.info(f"[Cleansing-{stage}] Row {row_index if row_index is not None else '-'} {field}: '{original}' -> '{cleaned}'" + (f" ({details})" if details else ""))
         event = {
             "timestamp": timestamp,
             "stage": stage.capitalize(),
@@ -964,24 +1069,32 @@ class Application(tk.Tk):
     def flush_cleansing_queue(self):
         if not hasattr(self, "cleansing_tree") or not self.cleansing_tree.winfo_exists():
             return
+        # Drain everything queued since the last poll, then update the Treeview once for the whole batch.
+        events = []
+        while True:
+            try: events.append(self.cleansing_queue.get_nowait())
+            except queue.Empty: break
         try:
-            while not self.cleansing_queue.empty():
-                event = self.cleansing_queue.get_nowait()
-                self.cleansing_events.append(event)
-                self.cleansing_tree.insert("", "end", values=(event["timestamp"], event["stage"], event["row"], event["field"], event["original"], event["cleaned"], event["details"]))
-        except queue.Empty:
-            pass
+            if events:
+                self.cleansing_events.extend(events)
+                for event in events[-CLEANSING_VIEW_MAX_ROWS:]:
+                    self.cleansing_tree.insert("", "end", values=(event["timestamp"], event["stage"], event["row"], event["field"], event["original"], event["cleaned"], event["details"]))
+                children = self.cleansing_tree.get_children()
+                if len(children) > CLEANSING_VIEW_MAX_ROWS: self.cleansing_tree.delete(*children[:len(children) - CLEANSING_VIEW_MAX_ROWS])
+        except tk.TclError as e:
+            logging.debug(f"Unable to show cleansing events: {e}")
         finally:
-            self.after(400, self.flush_cleansing_queue)
+            # Poll quickly while a run is producing events, lazily when idle
+            self.after(150 if len(events) > 100 else 400 if events else 800, self.flush_cleansing_queue)
     def populate_special_mapping_tab(self): # as original
-        for item in self.special_tree.get_children(): self.special_tree.delete(item)
+        self.special_tree.delete(*self.special_tree.get_children())
         for char, replacement in sorted(self.special_char_map.items()): self.special_tree.insert("", "end", values=(char, replacement))
     def add_special_mapping_row(self): self.special_tree.focus(self.special_tree.insert("", "end", values=("", ""))) # as original
     def remove_special_mapping_rows(self): # as original
         selected_items = self.special_tree.selection()
         if not selected_items: messagebox.showwarning("No Selection", "Please select row(s) to remove."); return
         if messagebox.askyesno("Confirm Removal", f"Are you sure you want to remove {len(selected_items)} selected mapping(s)?"):
-            for item_id in selected_items: self.special_tree.delete(item_id)
+            self.special_tree.delete(*selected_items)
     def on_special_tree_double_click(self, event): # as original
          region = self.special_tree.identify("region", event.x, event.y); col_id = self.special_tree.identify_column(event.x); row_id = self.special_tree.identify_row(event.y)
          if region == "cell" and row_id: self.edit_special_cell(row_id, col_id)
@@ -1000,8 +1113,7 @@ class Application(tk.Tk):
         cat_scroll = ttk.Scrollbar(list_frame, orient="vertical", command=self.cat_listbox.yview); self.cat_listbox.config(yscrollcommand=cat_scroll.set); cat_scroll.pack(side="right", fill="y"); self.cat_listbox.pack(side="left", fill="both", expand=True)
     def refresh_categories_listbox(self): # as original
         if not hasattr(self, "cat_listbox"): return
-        self.cat_listbox.delete(0, tk.END);
-        for cat in sorted(self.categories): self.cat_listbox.insert(tk.END, cat)
+        self.cat_listbox.delete(0, tk.END); self.cat_listbox.insert(tk.END, *sorted(self.categories))
     def add_category(self): # CORRECTED VERSION
         new_cat = simpledialog.askstring("Add Category", "Enter full category path:", parent=self)
         if new_cat and new_cat.strip():
@@ -1020,7 +1132,7 @@ class Application(tk.Tk):
         if not selected_indices: messagebox.showwarning("No Selection", "Please select categories to remove."); return
         selected_cats = [self.cat_listbox.get(i) for i in selected_indices]
         if messagebox.askyesno("Confirm Removal", f"Are you sure you want to remove {len(selected_cats)} selected categories?"):
-            for idx in reversed(selected_indices): self.categories.pop(self.categories.index(self.cat_listbox.get(idx)))
+            to_remove = set(selected_cats); self.categories = [c for c in self.categories if c not in to_remove]
             self.refresh_categories_listbox()
     # ... (rest of Application class methods like stop_flag_func, start_generation, _do_generation, _generation_complete, view_status_report, reprocess tab methods, project methods, on_closing, browse methods remain as original)
     def stop_flag_func(self): return self._stop_requested
@@ -1068,59 +1180,94 @@ class Application(tk.Tk):
         tree_frame = ttk.Frame(frame); tree_frame.pack(fill="both", expand=True, padx=10, pady=5); columns = ("unique_id", "identifier", "error", "action"); self.reprocess_tree = ttk.Treeview(tree_frame, columns=columns, show="headings", selectmode="extended")
         self.reprocess_tree.heading("unique_id", text="Unique ID"); self.reprocess_tree.column("unique_id", width=240, anchor="w", stretch=False); self.reprocess_tree.heading("identifier", text="Identifier (Title/Loc)"); self.reprocess_tree.column("identifier", width=200, anchor="w", stretch=True); self.reprocess_tree.heading("error", text="Import Error (from XML)"); self.reprocess_tree.column("error", width=300, anchor="w", stretch=True) ; self.reprocess_tree.heading("action", text="Action"); self.reprocess_tree.column("action", width=100, anchor="center", stretch=False)
         tree_vsb = ttk.Scrollbar(tree_frame, orient="vertical", command=self.reprocess_tree.yview); tree_hsb = ttk.Scrollbar(tree_frame, orient="horizontal", command=self.reprocess_tree.xview); self.reprocess_tree.configure(yscrollcommand=tree_vsb.set, xscrollcommand=tree_hsb.set); tree_vsb.pack(side="right", fill="y"); tree_hsb.pack(side="bottom", fill="x"); self.reprocess_tree.pack(side="left", fill="both", expand=True); self.reprocess_tree.bind("<Double-1>", self.on_reprocess_tree_double_click)
+        # One Action editor, moved over whichever cell is being edited and hidden again afterwards
+        self.reprocess_action_combo = ttk.Combobox(self.reprocess_tree, state="readonly"); self.reprocess_edit_cell = None
+        self.reprocess_action_combo.bind("<<ComboboxSelected>>", lambda e: (self.set_reprocess_action(self.reprocess_action_combo.get()), self.reprocess_action_combo.place_forget())); self.reprocess_action_combo.bind("<FocusOut>", lambda e: self.reprocess_action_combo.place_forget()); self.reprocess_action_combo.bind("<Escape>", lambda e: self.reprocess_action_combo.place_forget())
         bottom_frame = ttk.Frame(frame, padding=(10, 10)); bottom_frame.pack(fill="x"); self.generate_reprocess_button = ttk.Button(bottom_frame, text="Generate Reprocess XML File...", command=self.generate_reprocess_xml, state=tk.DISABLED); self.generate_reprocess_button.pack(); self.reprocess_entries = {}
     def load_uncreated_xml_and_prepare_reprocess(self): # as original
         if not self.db_available: messagebox.showerror("Database Error", "Database is not available."); return
+        if self._processing_thread and self._processing_thread.is_alive(): messagebox.showwarning("Busy", "A background process is already running."); return
         xml_path = filedialog.askopenfilename(filetypes=[("Uncreated XML", "*_uncreated.xml"), ("All Files", "*.*")], title="Select Content Server _uncreated.xml File");
         if not xml_path: return
         failed_items_from_xml = []; current_error = "Unknown Error"; node_xml_lines = []; in_node = False
         try:
-            with open(xml_path, 'r', encoding='utf-8') as f:
+            with open(xml_path, 'r', encoding='utf-8', buffering=1 << 20) as f: # 1 MiB reads: far fewer syscalls on large files
                 for line in f:
-                    stripped_line = line.strip(); match = re.match(r"<!-- Error:(.*)-->", stripped_line)
+                    stripped_line = line.strip(); match = _UNCREATED_ERROR_RE.match(stripped_line) if stripped_line.startswith("<!-- Error:") else None
                     if match: current_error = match.group(1).strip()
                     elif stripped_line.startswith("<node"): node_xml_lines = [stripped_line]; in_node = True
                     elif in_node: node_xml_lines.append(stripped_line)
                     if in_node and stripped_line.endswith("</node>"):
-                        in_node = False; node_xml = "\n".join(node_xml_lines); title_text = ET.fromstring(node_xml).findtext("title", default=""); loc_text = ET.fromstring(node_xml).findtext("location", default="")
+                        in_node = False; node_root = ET.fromstring("\n".join(node_xml_lines)); title_text = node_root.findtext("title", default=""); loc_text = node_root.findtext("location", default="")
                         identifier = title_text.strip() if title_text and title_text.strip() else (loc_text.strip() if loc_text and loc_text.strip() else "(Identifier unavailable)")
                         if identifier!="(Identifier unavailable)": failed_items_from_xml.append({'identifier': identifier, 'xml_error': current_error})
         except Exception as e: logging.exception(f"Error parsing _uncreated.xml: {xml_path}"); messagebox.showerror("Parse Error", f"Error reading _uncreated.xml:\n{e}"); return
         if not failed_items_from_xml: messagebox.showinfo("Info", "No failed node entries found."); self.populate_reprocess_tree([]); return
-        entries_for_treeview = []; regen_errors = 0; match_errors = 0
         if not self.mapping: messagebox.showerror("Error", "Cannot regenerate: CSV Mapping empty."); return
-        for failed_item in failed_items_from_xml:
-            db_object = db_handler.get_object_by_identifier(failed_item['identifier'], self.current_db_path)
-            if not db_object: match_errors +=1; entries_for_treeview.append({'unique_id': '(No DB Match)', 'identifier': failed_item['identifier'], 'error_message': failed_item['xml_error'], 'action_state': 'Skip'}); continue
-            if not db_object.get('csv_data'): regen_errors +=1; entries_for_treeview.append({**db_object, 'error_message': 'Original CSV data missing.', 'action_state': 'Skip'}); continue
-            node_elem, error_msg = process_row(db_object['csv_row_index'], db_object['csv_data'], self.mapping, self.default_location.get(), self.username.get(), self.action.get(), self.node_type.get(), self.category.get(), self.use_csv_createdby.get(), None, [], self.special_char_map, self.get_cleansing_options(), cleansing_callback=self.record_cleansing_action)
-            tree_entry = {**db_object, 'identifier': failed_item['identifier'], 'error_message': failed_item['xml_error'], 'generated_xml': ET.tostring(node_elem, encoding='unicode') if node_elem else None, 'action_state': 'Re-import' if node_elem else 'Skip'}
-            if not node_elem: regen_errors +=1; tree_entry['error_message'] = f"Regen Failed: {error_msg}"
-            entries_for_treeview.append(tree_entry)
-        self.populate_reprocess_tree(entries_for_treeview); messagebox.showinfo("Load Complete", f"Processed {len(failed_items_from_xml)} items. DB Matches: {len(failed_items_from_xml)-match_errors}. Regen Errors: {regen_errors}."); self.notebook.select(self.reprocess_frame)
+        # Snapshot the Tk variables here: the regeneration runs on a worker thread, which must not touch them.
+        regen_settings = (dict(self.mapping), self.default_location.get(), self.username.get(), self.action.get(), self.node_type.get(), self.category.get(), self.use_csv_createdby.get(), dict(self.special_char_map), self.get_cleansing_options(), self.current_db_path)
+        self.generate_reprocess_button.config(state=tk.DISABLED); logging.info(f"Regenerating {len(failed_items_from_xml)} failed items in the background.")
+        self._processing_thread = threading.Thread(target=self._do_reprocess_regen, args=(failed_items_from_xml, regen_settings), daemon=True); self._processing_thread.start()
+    def _do_reprocess_regen(self, failed_items_from_xml, regen_settings):
+        mapping, default_location, username, action, node_type, category, use_csv_createdby, special_char_map, cleansing_options, db_path = regen_settings
+        entries_for_treeview = []; regen_errors = 0; match_errors = 0
+        try:
+            mapping_plan = compile_mapping_plan(mapping); db_objects = db_handler.get_objects_by_identifiers((fi['identifier'] for fi in failed_items_from_xml), db_path)
+            for failed_item in failed_items_from_xml:
+                db_object = db_objects.get(failed_item['identifier'])
+                if not db_object: logging.warning(f"No database entry found matching identifier: '{failed_item['identifier']}'"); match_errors +=1; entries_for_treeview.append({'unique_id': '(No DB Match)', 'identifier': failed_item['identifier'], 'error_message': failed_item['xml_error'], 'action_state': 'Skip'}); continue
+                if not db_object.get('csv_data'): regen_errors +=1; entries_for_treeview.append({'unique_id': db_object['unique_id'], 'identifier': db_object.get('identifier'), 'error_message': 'Original CSV data missing.', 'action_state': 'Skip'}); continue
+                node_elem, error_msg = process_row(db_object['csv_row_index'], db_object['csv_data'], mapping, default_location, username, action, node_type, category, use_csv_createdby, None, {}, special_char_map, cleansing_options, cleansing_callback=self.record_cleansing_action, mapping_plan=mapping_plan)
+                tree_entry = {'unique_id': db_object['unique_id'], 'identifier': failed_item['identifier'], 'error_message': failed_item['xml_error'], 'generated_xml': ET.tostring(node_elem, encoding='unicode') if node_elem else None, 'action_state': 'Re-import' if node_elem else 'Skip'}
+                if not node_elem: regen_errors +=1; tree_entry['error_message'] = f"Regen Failed: {error_msg}"
+                entries_for_treeview.append(tree_entry)
+        except Exception as e: logging.exception("Error regenerating failed items."); self.after(0, self._reprocess_regen_complete, None, f"Failed to regenerate items:\n{e}"); return
+        self.after(0, self._reprocess_regen_complete, entries_for_treeview, f"Processed {len(failed_items_from_xml)} items. DB Matches: {len(failed_items_from_xml)-match_errors}. Regen Errors: {regen_errors}.")
+    def _reprocess_regen_complete(self, entries_for_treeview, message):
+        self._processing_thread = None
+        if entries_for_treeview is None: self.generate_reprocess_button.config(state=tk.NORMAL if self.reprocess_entries else tk.DISABLED); messagebox.showerror("Error", message); return
+        self.populate_reprocess_tree(entries_for_treeview); messagebox.showinfo("Load Complete", message); self.notebook.select(self.reprocess_frame)
     def populate_reprocess_tree(self, entries): # as original
-        for item_id in self.reprocess_tree.get_children(): self.reprocess_tree.delete(item_id)
+        self.reprocess_action_combo.place_forget(); self.reprocess_tree.delete(*self.reprocess_tree.get_children())
         self.reprocess_entries.clear(); self.generate_reprocess_button.config(state=tk.DISABLED)
         if not entries: return
-        for entry_data in entries: iid = self.reprocess_tree.insert("", "end", values=(entry_data.get('unique_id', ''), entry_data.get('identifier', ''), entry_data.get('error_message', ''), entry_data.get('action_state', 'Skip'))); entry_data['action_tkvar'] = tk.StringVar(value=entry_data.get('action_state', 'Skip')); self.reprocess_entries[iid] = entry_data
+        for entry_data in entries: iid = self.reprocess_tree.insert("", "end", values=(entry_data.get('unique_id', ''), entry_data.get('identifier', ''), entry_data.get('error_message', ''), entry_data.get('action_state', 'Skip'))); self.reprocess_entries[iid] = entry_data
         if entries: self.generate_reprocess_button.config(state=tk.NORMAL)
     def on_reprocess_tree_double_click(self, event): # as original
         region = self.reprocess_tree.identify("region", event.x, event.y); col_id = self.reprocess_tree.identify_column(event.x); row_id = self.reprocess_tree.identify_row(event.y)
         if region != "cell" or col_id != "#4" or not row_id or row_id not in self.reprocess_entries: return
-        x,y,w,h = self.reprocess_tree.bbox(row_id, col_id); action_var = self.reprocess_entries[row_id]['action_tkvar']; can_reimport = bool(self.reprocess_entries[row_id].get('generated_xml')); available = ["Re-import", "Skip"] if can_reimport else ["Skip"]; (action_var.set("Skip") if not can_reimport and action_var.get()=="Re-import" else None)
-        combo = ttk.Combobox(self.reprocess_tree, values=available, state="readonly", textvariable=action_var); combo.place(x=x,y=y,width=w,height=h); combo.focus_set()
-        combo.bind("<<ComboboxSelected>>", lambda e: combo.destroy()); combo.bind("<FocusOut>", lambda e: combo.destroy()); combo.bind("<Escape>", lambda e: combo.destroy())
+        x,y,w,h = self.reprocess_tree.bbox(row_id, col_id); entry_data = self.reprocess_entries[row_id]; self.reprocess_edit_cell = (row_id, col_id)
+        can_reimport = bool(entry_data.get('generated_xml'))
+        if not can_reimport and entry_data.get('action_state') == "Re-import": self.set_reprocess_action("Skip")
+        combo = self.reprocess_action_combo; combo.config(values=["Re-import", "Skip"] if can_reimport else ["Skip"]); combo.set(entry_data.get('action_state', 'Skip')); combo.place(x=x,y=y,width=w,height=h); combo.focus_set()
+    def set_reprocess_action(self, value):
+        if not self.reprocess_edit_cell or self.reprocess_edit_cell[0] not in self.reprocess_entries: return
+        row_id, col_id = self.reprocess_edit_cell; self.reprocess_entries[row_id]['action_state'] = value; self.reprocess_tree.set(row_id, col_id, value)
     def generate_reprocess_xml(self): # as original
         if not self.reprocess_entries: messagebox.showinfo("No Data", "No entries."); return
-        to_export = [{'unique_id': ed.get('unique_id'), 'generated_xml': ed.get('generated_xml'), 'action_state': 'Re-import'} for ed in self.reprocess_entries.values() if ed['action_tkvar'].get() == "Re-import" and ed.get('generated_xml')]
+        if self._processing_thread and self._processing_thread.is_alive(): messagebox.showwarning("Busy", "A background process is already running."); return
+        to_export = [{'iid': iid, 'unique_id': ed.get('unique_id'), 'generated_xml': ed.get('generated_xml'), 'action_state': 'Re-import'} for iid, ed in self.reprocess_entries.items() if ed.get('action_state') == "Re-import" and ed.get('generated_xml')]
         if not to_export: messagebox.showinfo("No Selection", "No valid entries for 'Re-import'."); return
         out_path = filedialog.asksaveasfilename(defaultextension=".xml", filetypes=[("XML Files", "*.xml")], title="Save Reprocess XML", initialfile="reprocess_import.xml")
         if not out_path: return
+        self.generate_reprocess_button.config(state=tk.DISABLED)
+        self._processing_thread = threading.Thread(target=self._do_save_reprocess, args=(to_export, out_path, self.current_db_path), daemon=True); self._processing_thread.start()
+    def _do_save_reprocess(self, to_export, out_path, db_path):
         try:
             ids, success = save_reprocessed_nodes(to_export, out_path)
-            if success: messagebox.showinfo("Success", f"Reprocess XML saved to:\n{out_path}"); [db_handler.update_object_status(uid, 'reprocessed', db_path=self.current_db_path) for uid in ids]; self.populate_reprocess_tree([])
-            else: messagebox.showwarning("File Not Saved", "Reprocess XML not saved.")
-        except Exception as e: logging.exception("Error generating reprocess XML"); messagebox.showerror("Error", f"Failed: {e}")
+            if success: db_handler.batch_update_object_statuses([{'unique_id': uid, 'status': 'reprocessed'} for uid in ids], db_path=db_path)
+            saved_ids = set(ids); self.after(0, self._save_reprocess_complete, success, out_path, None, [item['iid'] for item in to_export if item['unique_id'] in saved_ids])
+        except Exception as e: logging.exception("Error generating reprocess XML"); self.after(0, self._save_reprocess_complete, False, out_path, f"Failed: {e}", [])
+    def _save_reprocess_complete(self, success, out_path, error_message, saved_iids):
+        self._processing_thread = None
+        if success:
+            # Drop only the rows that went into the file; skipped rows stay for another pass
+            self.reprocess_tree.delete(*saved_iids)
+            for iid in saved_iids: self.reprocess_entries.pop(iid, None)
+            self.generate_reprocess_button.config(state=tk.NORMAL if self.reprocess_entries else tk.DISABLED); messagebox.showinfo("Success", f"Reprocess XML saved to:\n{out_path}"); return
+        self.generate_reprocess_button.config(state=tk.NORMAL if self.reprocess_entries else tk.DISABLED)
+        if error_message: messagebox.showerror("Error", error_message)
+        else: messagebox.showwarning("File Not Saved", "Reprocess XML not saved.")
     def open_project(self): # as original
         path = filedialog.askopenfilename(title="Open Project",filetypes=[("OI Project","*.json")]);
         if not path: return
@@ -1139,8 +1286,11 @@ class Application(tk.Tk):
     def on_closing(self): # as original
         if self._processing_thread and self._processing_thread.is_alive(): messagebox.showwarning("Process Running", "Cannot quit while generation is in progress."); return
         if messagebox.askokcancel("Quit", "Do you really want to quit?"):
-            try: save_config_to_path(self.gather_current_config_dict(), DEFAULT_CONFIG_FILE)
+            # Best-effort save: a hung drive must not stop the window from closing
+            try: saver = threading.Thread(target=save_config_to_path, args=(self.gather_current_config_dict(), DEFAULT_CONFIG_FILE), daemon=True); saver.start(); saver.join(timeout=CONFIG_SAVE_TIMEOUT_SECONDS)
             except Exception as e: logging.warning(f"Could not save fallback config: {e}")
+            else:
+                if saver.is_alive(): logging.warning(f"Fallback config save to {DEFAULT_CONFIG_FILE} still running after {CONFIG_SAVE_TIMEOUT_SECONDS}s; closing without waiting.")
             self.destroy()
     def browse_csv(self): path = filedialog.askopenfilename(title="Select CSV",filetypes=[("CSV","*.csv")]); (self.csv_file.set(path), self.populate_csv_mapping_tab()) if path else None
     def browse_xml(self): path = filedialog.asksaveasfilename(title="Select Output XML Base",defaultextension=".xml",filetypes=[("XML","*.xml")]); self.xml_base.set(path) if path else None
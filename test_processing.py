@@ -4,6 +4,7 @@ import os
 import json
 import datetime
 import uuid
+import functools
 import xml.etree.ElementTree as ET
 import tkinter as tk
 from tkinter import ttk
@@ -16,7 +17,7 @@ from oi_import_generator import process_row, generate_default_mapping, normalize
 import oi_import_generator as oi_generator
 
 # --- Import XML to CSV Converter ---
-from xml_to_csv_converter import convert_xml_to_csv
+from xml_to_csv_converter import convert_xml_to_csv, convert_records_to_csv, write_records_csv, sanitize_category_name
 import csv
 from io import StringIO
 
@@ -94,6 +95,16 @@ class TestDbHandler(unittest.TestCase):
         self.assertEqual(retrieved['csv_data'], csv_data_orig)
         self.assertIsNone(db_handler.get_object_status(uuid.uuid4().hex, self.db_path))
 
+    def test_csv_data_stored_as_compact_json(self):
+        obj_id = uuid.uuid4().hex
+        csv_data_orig = {'title': 'Pītau doc', 'loc': 'A:B'}
+        db_handler.add_pending_objects([{'unique_id': obj_id, 'csv_row_index': 1, 'csv_data': csv_data_orig}], self.db_path)
+        cursor = self.conn_for_schema_check.cursor()
+        cursor.execute("SELECT csv_data_json FROM objects WHERE unique_id = ?", (obj_id,))
+        stored = cursor.fetchone()[0]
+        self.assertEqual(stored, '{"title":"Pītau doc","loc":"A:B"}')
+        self.assertEqual(db_handler.get_object_status(obj_id, self.db_path)['csv_data'], csv_data_orig)
+
     def test_update_object_status(self):
         obj_id = uuid.uuid4().hex
         db_handler.add_pending_objects([{'unique_id': obj_id, 'csv_row_index': 1, 'csv_data': {'k': 'v'}}], self.db_path)
@@ -122,6 +133,21 @@ class TestDbHandler(unittest.TestCase):
         self.assertEqual(db_handler.get_object_status(ids[0], self.db_path)['generated_xml'], '<new_o1/>')
         self.assertEqual(db_handler.get_object_status(ids[1], self.db_path)['generated_xml'], f"<{ids[1][:4]}/>") # Should keep original
 
+    def test_batch_update_object_statuses_in_chunks(self):
+        ids = [uuid.uuid4().hex for _ in range(5)]
+        db_handler.add_pending_objects([{'unique_id': iid, 'csv_row_index': i+1, 'csv_data': {}} for i, iid in enumerate(ids)], self.db_path)
+        updates = [{'unique_id': iid, 'status': 'success'} for iid in ids] + [{'unique_id': 'missing', 'status': 'success'}]
+        updated_c, failed_c = db_handler.batch_update_object_statuses(updates, self.db_path, chunk_size=2)
+        self.assertEqual(updated_c, 5)
+        self.assertEqual(failed_c, 1)
+        self.assertEqual(db_handler.get_status_counts(self.db_path), {'success': 5})
+
+    def test_get_object_statuses(self):
+        ids = [uuid.uuid4().hex for _ in range(3)]
+        db_handler.add_pending_objects([{'unique_id': id, 'csv_row_index': i+1, 'csv_data':{}} for i,id in enumerate(ids)], self.db_path)
+        db_handler.update_object_status(ids[1], 'success', db_path=self.db_path)
+        self.assertEqual(db_handler.get_object_statuses(ids + ["missing", None], self.db_path, chunk_size=2), {ids[0]: 'pending', ids[1]: 'success', ids[2]: 'pending'})
+
     def test_get_objects_by_status(self):
         ids = [uuid.uuid4().hex for _ in range(3)]
         db_handler.add_pending_objects([{'unique_id': id, 'csv_row_index': i+1, 'csv_data':{}} for i,id in enumerate(ids)], self.db_path)
@@ -137,6 +163,15 @@ class TestDbHandler(unittest.TestCase):
         self.assertIsNotNone(db_handler.get_object_by_identifier(identifier, self.db_path))
         self.assertIsNone(db_handler.get_object_by_identifier("XYZ", self.db_path))
 
+    def test_get_objects_by_identifiers(self):
+        ids = [uuid.uuid4().hex for _ in range(4)]
+        db_handler.add_pending_objects([{'unique_id': id, 'csv_row_index': i+1, 'csv_data': {'Title': f'T{i}'}} for i,id in enumerate(ids)], self.db_path)
+        for id, identifier in zip(ids, ["A", "B", "C", "A"]): db_handler.update_object_status(id, 'failed', identifier=identifier, db_path=self.db_path)
+        found = db_handler.get_objects_by_identifiers(["A", "C", "XYZ", "A", ""], self.db_path, chunk_size=1)
+        self.assertEqual(sorted(found), ["A", "C"])
+        self.assertEqual(found["A"], db_handler.get_object_by_identifier("A", self.db_path)) # Same first match for duplicates
+        self.assertEqual(found["C"]['csv_data'], {'Title': 'T2'})
+
     def test_get_status_counts(self):
         ids = [uuid.uuid4().hex for _ in range(3)]
         db_handler.add_pending_objects([{'unique_id': id, 'csv_row_index': i+1, 'csv_data':{}} for i,id in enumerate(ids)], self.db_path)
@@ -177,31 +212,164 @@ class TestProcessRow(unittest.TestCase):
 
     def test_basic_document_creation_and_docnum(self):
         csv_data = {'csv_title': 'My Test Doc', 'csv_file': 'C:\\temp\\mydoc.pdf'}
-        node, err = process_row(1, csv_data, self.sample_mapping, self.default_loc, self.username, "sync", "document", self.category_default, False, None, [], self.special_map)
+        node, err = process_row(1, csv_data, self.sample_mapping, self.default_loc, self.username, "sync", "document", self.category_default, False, None, {}, self.special_map)
         self.assertIsNone(err)
         self.assertEqual(node.findtext("file"), 'C:/temp/mydoc.pdf')
 
     def test_action_update_metadata(self):
         csv_data = {'csv_title': 'Update Meta', 'csv_file': 'original.txt'}
-        node, err = process_row(1, csv_data, self.sample_mapping, self.default_loc, self.username, "update (metadata)", "document", self.category_default, True, None, [], self.special_map)
+        node, err = process_row(1, csv_data, self.sample_mapping, self.default_loc, self.username, "update (metadata)", "document", self.category_default, True, None, {}, self.special_map)
         self.assertIsNone(err)
         self.assertEqual(node.attrib["action"], "update")
 
     def test_error_missing_action_nodetype(self):
         csv_data = {'csv_title': 'Bad Data'}
         minimal_mapping = {'csv_title': {'MappingType': 'Standard', 'TargetLabel': 'title'}}
-        node, err = process_row(1, csv_data, minimal_mapping, self.default_loc, self.username, "none", "none", self.category_default, True, None, [], self.special_map)
+        node, err = process_row(1, csv_data, minimal_mapping, self.default_loc, self.username, "none", "none", self.category_default, True, None, {}, self.special_map)
         self.assertIsNone(node)
         self.assertIn("Missing required 'action' or 'nodetype'", err)
 
     def test_location_cleaning(self):
         csv_data = {'csv_loc': 'Parent:Folder:With:Colons'}
-        node, _ = process_row(1, csv_data, self.sample_mapping, "", "", "sync", "folder", "", True, None, [], self.special_map)
+        node, _ = process_row(1, csv_data, self.sample_mapping, "", "", "sync", "folder", "", True, None, {}, self.special_map)
         self.assertEqual(node.findtext("location"), "Parent:Folder:With:Colons")
         csv_data_2 = {'csv_loc': 'A:B:C:D'}
-        node2, _ = process_row(1, csv_data_2, self.sample_mapping, "", "", "sync", "folder", "", True, None, [], self.special_map)
+        node2, _ = process_row(1, csv_data_2, self.sample_mapping, "", "", "sync", "folder", "", True, None, {}, self.special_map)
         self.assertEqual(node2.findtext("location"), "A:B:C:D")
 
+    def test_compile_mapping_plan(self):
+        mapping = {
+            'csv_title': {'MappingType': 'Standard', 'TargetLabel': 'title', 'Category': ''},
+            'csv_action': {'MappingType': 'Standard', 'TargetLabel': 'Action', 'Category': ''},
+            'colour': {'MappingType': 'Metadata', 'TargetLabel': 'Colour', 'Category': 'Cat:A, ,Cat:B'},
+            'skip_me': {'MappingType': 'Ignore', 'TargetLabel': 'skip', 'Category': ''},
+        }
+        self.assertEqual(oi_generator.compile_mapping_plan(mapping), [
+            ('csv_title', oi_generator.MAP_STANDARD, 'title', 'title', ()),
+            ('csv_action', oi_generator.MAP_STANDARD, 'Action', 'action', ()),
+            ('colour', oi_generator.MAP_METADATA, 'Colour', 'Colour', ('Cat:A', 'Cat:B')),
+        ])
+
+    def test_split_xml_path(self):
+        self.assertEqual(oi_generator.split_xml_path("C:/dir//sub/file.pdf"), ("C:/dir/sub/", "file.pdf"))
+        self.assertEqual(oi_generator.split_xml_path("C:/file.pdf"), ("C:/", "file.pdf"))
+        self.assertEqual(oi_generator.split_xml_path("//server/share/file.pdf"), ("//server/share/", "file.pdf"))
+        self.assertEqual(oi_generator.split_xml_path("rel/./a/../file.pdf"), ("rel/", "file.pdf"))
+        self.assertEqual(oi_generator.split_xml_path("file.pdf"), ("", "file.pdf"))
+
+    def test_column_lookup_matches_headers_loosely(self):
+        self.assertEqual(oi_generator.csv_column_keys((' CSV_Title ', 'csv_title', None)), {'csv_title': ' CSV_Title '}) # First match wins; surplus-field key ignored
+        csv_data = {' CSV_Title ': 'Padded Header Doc', 'csv_loc': 'Some:Where', None: ['extra']}
+        node, err = process_row(1, csv_data, self.sample_mapping, self.default_loc, self.username, "sync", "folder", self.category_default, False, None, {}, self.special_map)
+        self.assertIsNone(err)
+        self.assertEqual(node.findtext('title'), 'Padded Header Doc')
+
+    def test_detect_csv_dialect(self):
+        f = StringIO("a;b;c\n1;2;3\n")
+        self.assertEqual(oi_generator.detect_csv_dialect(f).delimiter, ";")
+        self.assertEqual(f.tell(), 0)
+        custom = oi_generator.detect_csv_dialect(f, "|", "'")
+        self.assertEqual((custom.delimiter, custom.quotechar), ("|", "'"))
+        self.assertIs(oi_generator.detect_csv_dialect(f, "|", "'"), custom)
+        self.assertEqual(next(csv.reader(StringIO("a|'b|c'"), dialect=custom)), ["a", "b|c"])
+
+class TestWriteXmlBatch(unittest.TestCase):
+    def setUp(self):
+        self.output_path = f"test_batch_{uuid.uuid4().hex}.xml"
+
+    def tearDown(self):
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
+
+    def test_returns_serialized_xml_per_node(self):
+        node_a = ET.Element("node", attrib={"type": "folder", "action": "sync"}); ET.SubElement(node_a, "title").text = "A & B"
+        node_b = ET.Element("node", attrib={"type": "folder", "action": "sync"}); ET.SubElement(node_b, "title").text = "C"
+        xml_by_id = oi_generator.write_xml_batch([(node_a, "id_a"), (None, "id_none"), (node_b, "id_b")], self.output_path, "")
+        self.assertEqual(list(xml_by_id), ["id_a", "id_b"])
+        self.assertEqual(xml_by_id["id_a"], '<node type="folder" action="sync"><title>A &amp; B</title></node>')
+        with open(self.output_path, encoding="utf-8") as f:
+            written = f.read()
+        self.assertEqual(written, '<?xml version="1.0" encoding="utf-8"?>\n<import>' + xml_by_id["id_a"] + xml_by_id["id_b"] + '</import>')
+
+    def test_serialize_element_escaping(self):
+        node = ET.Element("node", attrib={"name": 'A & "B" <C>'}); ET.SubElement(node, "title").text = "x < y & z > w"
+        xml_str = oi_generator.serialize_element(node, set())
+        self.assertEqual(xml_str, '<node name="A &amp; &quot;B&quot; &lt;C>"><title>x &lt; y &amp; z &gt; w</title></node>')
+        self.assertEqual(ET.fromstring(xml_str).attrib["name"], 'A & "B" <C>')
+        self.assertEqual(oi_generator.serialize_element(node, {"title"}), '<node name="A &amp; &quot;B&quot; &lt;C>"><title><![CDATA[x < y & z > w]]></title></node>')
+
+    def test_rename_script_has_one_line_per_file(self):
+        rename_list = {}
+        for _ in range(3):
+            process_row(1, {'csv_title': 'V', 'csv_file': 'C:\\data\\a:b.pdf'}, {'csv_title': {'MappingType': 'Standard', 'TargetLabel': 'title'}, 'csv_file': {'MappingType': 'Standard', 'TargetLabel': 'file'}}, "", "u", "sync", "document", "", False, None, rename_list, DEFAULT_SPECIAL_CHAR_MAP)
+        self.assertEqual(rename_list, {'C:\\data\\a:b.pdf': 'C:/data/ab.pdf'})
+        output_dir = os.path.dirname(os.path.abspath(self.output_path))
+        script_path = oi_generator.generate_rename_script(rename_list, output_dir)
+        try:
+            with open(script_path, encoding="utf-8") as f:
+                lines = f.read().splitlines()
+            self.assertEqual(lines[1:], ['Rename-Item -Path "C:\\data\\a:b.pdf" -NewName "ab.pdf" -ErrorAction SilentlyContinue'])
+        finally:
+            os.remove(script_path)
+
+    def test_save_reprocessed_nodes(self):
+        reprocess_data = [
+            {'unique_id': 'a', 'generated_xml': '<node type="folder" action="sync"><title>A &amp; B</title></node>', 'action_state': 'Re-import'},
+            {'unique_id': 'b', 'generated_xml': None, 'action_state': 'Re-import'},
+            {'unique_id': 'c', 'generated_xml': '<node type="folder" action="sync" />', 'action_state': 'Skip'},
+            {'unique_id': 'd', 'generated_xml': '<node>broken', 'action_state': 'Re-import'},
+        ]
+        ids, success = oi_generator.save_reprocessed_nodes(reprocess_data, self.output_path, validate=True)
+        self.assertTrue(success)
+        self.assertEqual(ids, ['a'])
+        root = ET.parse(self.output_path).getroot()
+        self.assertEqual(root.tag, "import")
+        self.assertEqual([n.findtext("title") for n in root], ["A & B"])
+        self.assertEqual(oi_generator.save_reprocessed_nodes(reprocess_data[1:3], self.output_path), ([], False))
+        self.assertFalse(os.path.exists(self.output_path + ".tmp"))
+        self.assertEqual([n.findtext("title") for n in ET.parse(self.output_path).getroot()], ["A & B"]) # Earlier output left intact
+
+    def test_save_config_to_path_round_trips(self):
+        config = {"categories": ["Content Server Categories:Pītau Categories:Pītau documents"], "special_char_map": {"&": "and"}}
+        oi_generator.save_config_to_path(config, self.output_path)
+        self.assertEqual(oi_generator.load_config_from_path(self.output_path), config)
+        oi_generator.save_config_to_path({"unserializable": object()}, self.output_path)
+        self.assertEqual(oi_generator.load_config_from_path(self.output_path), config) # A failed save keeps the earlier file
+        output_dir, output_name = os.path.split(os.path.abspath(self.output_path))
+        self.assertFalse([name for name in os.listdir(output_dir) if name.startswith(output_name + ".") and name.endswith(".tmp")]) # No temp file left behind
+
+    def test_empty_batch_writes_nothing(self):
+        self.assertEqual(oi_generator.write_xml_batch([(None, "id_none")], self.output_path, "*"), {})
+        self.assertFalse(os.path.exists(self.output_path))
+
+
+class TestRunProcessing(unittest.TestCase):
+    def setUp(self):
+        run_id = uuid.uuid4().hex
+        self.db_path = f"test_oi_status_{run_id}.db"; self.csv_path = f"test_input_{run_id}.csv"
+        self.xml_base = f"test_output_{run_id}.xml"; self.batch_path = f"test_output_{run_id}_1.xml"
+        self.assertTrue(db_handler.init_db(self.db_path))
+        with open(self.csv_path, "w", encoding="utf-8", newline="") as f:
+            f.write("title,location\n" + "".join(f"Doc {i},Ent:Area\n" for i in range(5)))
+        # run_processing uses the default DB; point the three calls it makes at the test DB.
+        self.db_patches = [patch.object(db_handler, name, functools.partial(getattr(db_handler, name), db_path=self.db_path))
+                           for name in ("add_pending_objects", "get_object_statuses", "batch_update_object_statuses")]
+        for db_patch in self.db_patches: db_patch.start()
+
+    def tearDown(self):
+        for db_patch in self.db_patches: db_patch.stop()
+        for path in (self.db_path, self.db_path + "-wal", self.db_path + "-shm", self.csv_path, self.batch_path):
+            if os.path.exists(path): os.remove(path)
+
+    def test_stop_mid_batch_writes_built_nodes(self):
+        stop_checks = iter([False, False, True])
+        oi_generator.run_processing(self.csv_path, self.xml_base, "", "", "u", {}, "sync", "document", 100, False, "", False, ",", '"', "", stop_flag_func=lambda: next(stop_checks))
+        succeeded = db_handler.get_objects_by_status(["success"], self.db_path)
+        self.assertEqual([o['identifier'] for o in succeeded], ["Doc 0", "Doc 1"])
+        self.assertTrue(all(o['generated_xml'] and o['output_batch_file'] == os.path.abspath(self.batch_path) for o in succeeded))
+        self.assertEqual([n.findtext("title") for n in ET.parse(self.batch_path).getroot()], ["Doc 0", "Doc 1"])
+        self.assertEqual(len(db_handler.get_objects_by_status(["pending"], self.db_path)), 3)
+
 
 @unittest.skipIf(not os.environ.get('DISPLAY'), "Skipping UI test in headless environment")
 class TestApplicationUI(unittest.TestCase):
@@ -370,6 +538,10 @@ class TestXmlToCsvConverter(unittest.TestCase):
         csv_output = convert_xml_to_csv(self.malformed_xml)
         self.assertTrue(csv_output.startswith("Error:"), "Malformed XML should result in an error message string.")
 
+    def test_sanitize_category_name(self):
+        for name in ["Content Server Categories:Contextual Information", "Pītau Categories:Pītau documents", "a—b’c", ""]:
+            self.assertEqual(sanitize_category_name(name), "".join(c if c.isalnum() else '_' for c in name))
+
     def test_header_consistency_and_sorting(self):
         csv_output = convert_xml_to_csv(self.simple_xml_folder_node)
         if not csv_output.strip():
@@ -378,5 +550,43 @@ class TestXmlToCsvConverter(unittest.TestCase):
         header = next(reader)
         self.assertEqual(header, sorted(list(set(header))), "Headers should be sorted alphabetically.")
 
+class TestXmlFieldDiscovery(unittest.TestCase):
+    def setUp(self):
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        self.sample_xml_path = os.path.join(base_dir, "test_fixtures", "oi_example_for_csv_conversion.xml")
+
+    def test_streamed_discovery_finds_all_fields(self):
+        streamed, records = oi_generator.get_all_fields_from_xml_file(self.sample_xml_path)
+        self.assertEqual([tag for tag, _ in records], [element.tag for element in ET.parse(self.sample_xml_path).getroot()])
+        self.assertEqual(streamed["folder"], {"action", "element_tag", "location", "title", "title_language", "type"})
+        self.assertEqual(streamed["node"], {"action", "category_Content_Server_Categories_Contextual_Information_Branch", "category_Content_Server_Categories_Contextual_Information_Role", "created", "createdby", "createdby_type", "description_clear", "description_language", "element_tag", "externalcreatedate", "externalidentity", "externalidentitytype", "externalmodifydate", "externalsource", "file", "filename", "filetype", "location", "mime", "modified", "rmclassification_classpath", "rmclassification_essential", "rmclassification_filenumber", "rmclassification_official", "rmclassification_primary", "rmclassification_recorddate", "rmclassification_rsi", "rmclassification_status", "rmclassification_statusdate", "rmclassification_storage", "rmclassification_subject", "rootPathID", "title", "title_language", "type"})
+        self.assertFalse(any(field.startswith("acl") for fields in streamed.values() for field in fields)) # ACLs are ignored
+
+    def test_records_render_baseline_csv(self):
+        # Expected output captured from the original string-based converter on the sample fixture
+        _, records = oi_generator.get_all_fields_from_xml_file(self.sample_xml_path)
+        full_header = ["action", "category_Content_Server_Categories_Contextual_Information_Branch", "category_Content_Server_Categories_Contextual_Information_Role", "created", "createdby", "createdby_type", "description_clear", "description_language", "element_tag", "externalcreatedate", "externalidentity", "externalidentitytype", "externalmodifydate", "externalsource", "file", "filename", "filetype", "location", "mime", "modified", "rmclassification_classpath", "rmclassification_essential", "rmclassification_filenumber", "rmclassification_official", "rmclassification_primary", "rmclassification_recorddate", "rmclassification_rsi", "rmclassification_status", "rmclassification_statusdate", "rmclassification_storage", "rmclassification_subject", "rootPathID", "title", "title_language", "type"]
+        full_rows = list(csv.reader(StringIO(convert_records_to_csv(records))))
+        self.assertEqual(full_rows[0], full_header)
+        self.assertEqual(len(full_rows), 6)
+        selected = {"node": ["element_tag", "title", "rmclassification_essential", "category_Content_Server_Categories_Contextual_Information_Role"]}
+        self.assertEqual(convert_records_to_csv(records, selected), (
+            '"action","category_Content_Server_Categories_Contextual_Information_Role","element_tag","location","rmclassification_essential","title","title_language","type"\n'
+            '"create","","folder","ENTERPRISE:TESTFOLDER","","CPD-029931","en_NZ","folder"\n'
+            '"create","","folder","ENTERPRISE:TESTFOLDER","","CPD-030870","en_NZ","folder"\n'
+            '"create","","folder","ENTERPRISE:TESTFOLDER","","CPD-028947","en_NZ","folder"\n'
+            '"","Advisor","node","","NON-VITAL","Example PDF with version","",""\n'
+            '"","","node","","","","",""\n'))
+        self.assertEqual(convert_records_to_csv(records, {"folder": [], "node": ["location"]}), '"location"\n"Enterprise:Test"\n"Enterprise:Test:Example PDF with version"\n')
+
+    def test_write_records_csv_streams_to_file_handle(self):
+        _, records = oi_generator.get_all_fields_from_xml_file(self.sample_xml_path)
+        out = StringIO()
+        self.assertTrue(write_records_csv(records, None, out))
+        self.assertEqual(out.getvalue(), convert_records_to_csv(records))
+        empty = StringIO()
+        self.assertFalse(write_records_csv(records, {"node": [], "folder": []}, empty))
+        self.assertEqual(empty.getvalue(), "")
+
 if __name__ == '__main__':
     unittest.main(verbosity=2)